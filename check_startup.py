@@ -0,0 +1,92 @@
+# coding=utf-8
+"""
+Check that `scale_generator.py --count` still starts up quickly.
+
+--count is run thousands of times at a go, so it mustn't import anything it doesn't need.  This runs it, and fails if
+any of the slow modules below were imported, or if its imports took longer than the budget.
+
+Run with `python check_startup.py`.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+# Modules --count mustn't import, along with anything inside them
+HEAVY_MODULES = ["midiutil", "multiprocessing", "numpy", "scale_generator.pipeline"]
+
+# How long --count's imports may take, in milliseconds, as `python -X importtime` counts them.  Python's own start-up
+# isn't included.
+IMPORT_BUDGET_MS = 40
+
+# Where scale_generator.py is
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Runs --count, then lists the modules it imported on stderr
+_LIST_MODULES = """
+import json, runpy, sys
+sys.argv = ["scale_generator.py", "--count"]
+runpy.run_path("scale_generator.py", run_name="__main__")
+sys.stderr.write(json.dumps(sorted(sys.modules)))
+"""
+
+
+def heavy_modules_imported():
+	"""
+	The heavy modules which `scale_generator.py --count` imports.
+	:return:
+	"""
+	run = subprocess.run([sys.executable, "-c", _LIST_MODULES], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+						 cwd=_HERE, check=True, universal_newlines=True)
+	imported = json.loads(run.stderr)
+	return [module for module in imported
+			if any(module == heavy or module.startswith(heavy + ".") for heavy in HEAVY_MODULES)]
+
+
+def import_time_ms():
+	"""
+	How long `scale_generator.py --count`'s imports take, in milliseconds, leaving out what Python imports anyway.
+	:return:
+	"""
+	started = _top_level_import_times([sys.executable, "-X", "importtime", "-c", "pass"])
+	counted = _top_level_import_times([sys.executable, "-X", "importtime", "scale_generator.py", "--count"])
+	return sum(microseconds for module, microseconds in counted.items() if module not in started) / 1000
+
+
+def _top_level_import_times(command):
+	"""
+	The cumulative time, in microseconds, of each import not made by another module, from `python -X importtime`.
+	"""
+	run = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, cwd=_HERE, check=True,
+						 universal_newlines=True)
+	times = {}
+	for line in run.stderr.splitlines():
+		if not line.startswith("import time:"):
+			continue
+		self_time, cumulative_time, name = line[len("import time:"):].split("|")
+		# Imports made by other modules are indented under them
+		if name.startswith(" ") and not name.startswith("  ") and cumulative_time.strip().isdigit():
+			times[name.strip()] = int(cumulative_time)
+	return times
+
+
+def main():
+	failed = False
+
+	heavy = heavy_modules_imported()
+	if heavy:
+		print("--count imported {0}.".format(", ".join(heavy)))
+		failed = True
+
+	# The quickest of a few runs, so a busy machine doesn't make it fail
+	milliseconds = min(import_time_ms() for run in range(5))
+	print("--count's imports took {0:.1f} ms, of a budget of {1} ms.".format(milliseconds, IMPORT_BUDGET_MS))
+	if milliseconds > IMPORT_BUDGET_MS:
+		failed = True
+
+	sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+	main()
@@ -10,7 +10,7 @@
 #              software is distributed.
 #-----------------------------------------------------------------------------
 
-import struct,  sys,  math
+import struct,  sys,  math,  io,  mmap,  os
 
 # TICKSPERBEAT is the number of "ticks" (time measurement in the MIDI file) that
 # corresponds to one beat. This number is somewhat arbitrary, but should be chosen
@@ -21,28 +21,38 @@ TICKSPERBEAT = 960
 controllerEventTypes = {
                         'pan' : 0x0a
                         }
+
+# Packers for the fixed-size parts of events
+
+twoBytes = struct.Struct('>BB')
+threeBytes = struct.Struct('>BBB')
+fourBytes = struct.Struct('>BBBB')
+tempoEvent = struct.Struct('>BBBBH')
+endOfTrack = struct.pack('BBBB',0x00,0xFF,0x2F,0x00)
+
+# Unpackers for reading
+
+chunkHeader = struct.Struct('>4sL')
+fileHeader = struct.Struct('>HHH')
+
 class MIDIEvent:
     '''
     The class to contain the MIDI Event (placed on MIDIEventList.
+    
+    To keep large tracks cheap, an event only holds its type, time and ordinality,
+    and refers back to the event in the eventList it was made from for everything else.
     '''
-    def __init__(self):
-        self.type='unknown'
-        self.time=0
-        self.ord = 0
+    __slots__ = ('type', 'time', 'ord', 'source')
+    
+    def __init__(self, type='unknown', time=0, ord=0, source=None):
+        self.type = type
+        self.time = time
+        self.ord = ord
+        self.source = source
         
     def __lt__(self, other):
         ''' Sorting function for events.'''
-        if self.time < other.time:
-            return True
-        elif self.time > other.time:
-            return False
-        else:
-            if self.ord < other.ord:
-                return True
-            elif self.ord > other.ord:
-                return False
-            else:
-                return False
+        return (self.time, self.ord) < (other.time, other.ord)
 
     def __cmp__(self, other):
         ''' Sorting function for events.'''
@@ -61,81 +71,35 @@ class MIDIEvent:
 class GenericEvent():
     '''The event class from which specific events are derived
     '''
+    __slots__ = ('time', 'type')
+    
     def __init__(self,time):
         self.time = time 
         self.type = 'Unknown'
 
-
+    def identity(self):
+        '''
+        The things which make two events the same, as a tuple.
+        
+        In the processing of the event list, we have need to remove duplicates. Two events
+        are duplicates if they happen at the same time, are of the same type, and agree on
+        whatever else their class's identity() includes.
+        '''
+        return (self.time, self.type)
         
     def __eq__(self, other):
         '''
         Equality operator for Generic Events and derived classes.
-        
-        In the processing of the event list, we have need to remove duplicates. To do this
-        we rely on the fact that the classes are hashable, and must therefore have an 
-        equality operator (__hash__() and __eq__() must both be defined).
-        
-        This is the most embarrassing portion of the code, and anyone who knows about OO
-        programming would find this almost unbelievable. Here we have a base class that
-        knows specifics about derived classes, thus breaking the very spirit of 
-        OO programming.
-        
-        I suppose I should go back and restructure the code, perhaps removing the derived
-        classes altogether. At some point perhaps I will.
         '''
-        if self.time != other.time or self.type != other.type:
-            return False
-            
-        # What follows is code that encodes the concept of equality for each derived 
-        # class. Believe it f you dare.
-        
-        if self.type == 'note':
-            if self.pitch != other.pitch or self.channel != other.channel:
-                return False
-        if self.type == 'tempo':
-            if self.tempo != other.tempo:
-                return False
-        if self.type == 'programChange':
-            if self.programNumber != other.programNumber or self.channel != other.channel:
-                return False
-        if self.type == 'trackName':
-            if self.trackName != other.trackName:
-                return False
-        if self.type == 'controllerEvent':
-            if self.parameter1 != other.parameter1 or \
-                self.channel != other.channel or \
-                self.eventType != other.eventType:
-                return False
-                
-        if self.type == 'SysEx':
-            if self.manID != other.manID:
-                return False
-                
-        if self.type == 'UniversalSysEx':
-            if self.code != other.code or\
-                self.subcode != other.subcode or \
-                self.sysExChannel != other.sysExChannel:
-                return False
-                
-        return True
+        return self.identity() == other.identity()
         
     def __hash__(self):
         '''
         Return a hash code for the object.
         
-        This is needed for the removal of duplicate objects from the event list. The only
-        real requirement for the algorithm is that the hash of equal objects must be equal.
-        There is probably great opportunity for improvements in the hashing function.
+        The only real requirement is that the hash of equal objects must be equal.
         '''
-        # Robert Jenkin's 32 bit hash.
-        a = int(self.time)
-        a = (a+0x7ed55d16) + (a<<12)
-        a = (a^0xc761c23c) ^ (a>>19)
-        a = (a+0x165667b1) + (a<<5)
-        a = (a+0xd3a2646c) ^ (a<<9)
-        a = (a+0xfd7046c5) + (a<<3)
-        a = (a^0xb55a4f09) ^ (a>>16)
-        return a
+        return hash(self.identity())
 
 class MIDITrack:
     '''A class that encapsulates a MIDI track
@@ -145,6 +109,8 @@ class MIDITrack:
     class note(GenericEvent):
         '''A class that encapsulates a note
         '''
+        __slots__ = ('pitch', 'duration', 'volume', 'channel')
+        
         def __init__(self,channel, pitch,time,duration,volume):
             
             GenericEvent.__init__(self,time)
@@ -167,19 +133,28 @@ class MIDITrack:
             else:
                     return False
                     
+        def identity(self):
+            return (self.time, self.type, self.pitch, self.channel)
+                    
             
     class tempo(GenericEvent):
         '''A class that encapsulates a tempo meta-event
         '''
+        __slots__ = ('tempo',)
+        
         def __init__(self,time,tempo):
             
             GenericEvent.__init__(self,time)
             self.type = 'tempo'
             self.tempo = int(60000000 / tempo)
             
+        def identity(self):
+            return (self.time, self.type, self.tempo)
+            
     class programChange(GenericEvent):
         '''A class that encapsulates a program change event.
         '''
+        __slots__ = ('programNumber', 'channel')
         
         def __init__(self,  channel,  time,  programNumber):
             GenericEvent.__init__(self, time,)
@@ -187,9 +162,13 @@ class MIDITrack:
             self.programNumber = programNumber
             self.channel = channel
             
+        def identity(self):
+            return (self.time, self.type, self.programNumber, self.channel)
+            
     class SysExEvent(GenericEvent):
         '''A class that encapsulates a System Exclusive  event.
         '''
+        __slots__ = ('manID', 'payload')
         
         def __init__(self,  time,  manID,  payload):
             GenericEvent.__init__(self, time,)
@@ -197,9 +176,13 @@ class MIDITrack:
             self.manID = manID
             self.payload = payload
             
+        def identity(self):
+            return (self.time, self.type, self.manID)
+            
     class UniversalSysExEvent(GenericEvent):
         '''A class that encapsulates a Universal System Exclusive  event.
         '''
+        __slots__ = ('realTime', 'sysExChannel', 'code', 'subcode', 'payload')
         
         def __init__(self,  time,  realTime,  sysExChannel,  code,  subcode,  payload):
             GenericEvent.__init__(self, time,)
@@ -210,9 +193,13 @@ class MIDITrack:
             self.subcode = subcode
             self.payload = payload
             
+        def identity(self):
+            return (self.time, self.type, self.code, self.subcode, self.sysExChannel)
+            
     class ControllerEvent(GenericEvent):
         '''A class that encapsulates a program change event.
         '''
+        __slots__ = ('parameter1', 'channel', 'eventType')
         
         def __init__(self,  channel,  time,  eventType,  parameter1,):
             GenericEvent.__init__(self, time,)
@@ -220,15 +207,22 @@ class MIDITrack:
             self.parameter1 = parameter1
             self.channel = channel
             self.eventType = eventType
+            
+        def identity(self):
+            return (self.time, self.type, self.parameter1, self.channel, self.eventType)
 
     class trackName(GenericEvent):
         '''A class that encapsulates a program change event.
         '''
+        __slots__ = ('trackName',)
         
         def __init__(self,  time,  trackName):
             GenericEvent.__init__(self, time,)
             self.type = 'trackName'
             self.trackName = trackName
+            
+        def identity(self):
+            return (self.time, self.type, self.trackName)
 
             
     def __init__(self, removeDuplicates,  deinterleave):
@@ -308,121 +302,52 @@ class MIDITrack:
         Process the event list, creating a MIDIEventList
         
         For each item in the event list, one or more events in the MIDIEvent
-        list are created.
+        list are created.  They are then put in order of time, and for events at
+        the same time by their ordinality, so that things like program changes
+        come before notes.
         '''
         
         # Loop over all items in the eventList
         
+        MIDIEventList = self.MIDIEventList
         for thing in self.eventList:
-            if thing.type == 'note':
-                event = MIDIEvent()
-                event.type = "NoteOn"
-                event.time = thing.time * TICKSPERBEAT
-                event.pitch = thing.pitch
-                event.volume = thing.volume
-                event.channel = thing.channel
-                event.ord = 3
-                self.MIDIEventList.append(event)
-
-                event = MIDIEvent()
-                event.type = "NoteOff"
-                event.time = (thing.time + thing.duration) * TICKSPERBEAT
-                event.pitch = thing.pitch
-                event.volume = thing.volume
-                event.channel = thing.channel
-                event.ord = 2
-                self.MIDIEventList.append(event)
-
-            elif thing.type == 'tempo':
-                event = MIDIEvent()
-                event.type = "Tempo"
-                event.time = thing.time * TICKSPERBEAT
-                event.tempo = thing.tempo
-                event.ord = 3
-                self.MIDIEventList.append(event)
-
-            elif thing.type == 'programChange':
-                event = MIDIEvent()
-                event.type = "ProgramChange"
-                event.time = thing.time * TICKSPERBEAT
-                event.programNumber = thing.programNumber
-                event.channel = thing.channel
-                event.ord = 1
-                self.MIDIEventList.append(event)
-
-            elif thing.type == 'trackName':
-                event = MIDIEvent()
-                event.type = "TrackName"
-                event.time = thing.time * TICKSPERBEAT
-                event.trackName = thing.trackName
-                event.ord = 0
-                self.MIDIEventList.append(event)
-
-            elif thing.type == 'controllerEvent':
-                event = MIDIEvent()
-                event.type = "ControllerEvent"
-                event.time = thing.time * TICKSPERBEAT
-                event.eventType = thing.eventType
-                event.channel = thing.channel
-                event.paramerter1 = thing.parameter1
-                event.ord = 1
-                self.MIDIEventList.append(event)
-
-            elif thing.type == 'SysEx':
-                event = MIDIEvent()
-                event.type = "SysEx"
-                event.time = thing.time * TICKSPERBEAT
-                event.manID = thing.manID
-                event.payload = thing.payload
-                event.ord = 1
-                self.MIDIEventList.append(event)
-
-            elif thing.type == 'UniversalSysEx':
-                event = MIDIEvent()
-                event.type = "UniversalSysEx"
-                event.realTime = thing.realTime
-                event.sysExChannel = thing.sysExChannel
-                event.time = thing.time * TICKSPERBEAT
-                event.code = thing.code
-                event.subcode = thing.subcode
-                event.payload = thing.payload
-                event.ord = 1
-                self.MIDIEventList.append(event)
-
-            else:
+            try:
+                makeEvents = eventMakers[thing.type]
+            except KeyError:
                 print ("Error in MIDITrack: Unknown event type")
                 sys.exit(2)
+            makeEvents(MIDIEventList, thing)
             
-        # Assumptions in the code expect the list to be time-sorted.
-        # self.MIDIEventList.sort(lambda x, y: x.time - y.time)
-
-        self.MIDIEventList.sort(key=lambda x: (x.time))
+        # Python's sort is stable, so events at the same time and of the same ordinality
+        # keep the order they were made in.
 
         if self.deinterleave:    
+            # Assumptions in the code expect the list to be time-sorted.
+            MIDIEventList.sort(key=lambda x: x.time)
             self.deInterleaveNotes()
+            # We want to make sure that NoteOff events appear before NoteOn events.
+            MIDIEventList.sort(key=lambda x: (x.time, x.ord, x.type))
+        else:
+            MIDIEventList.sort(key=lambda x: (x.time, x.ord))
 
     def removeDuplicates(self):
         '''
         Remove duplicates from the eventList.
         
         This function will remove duplicates from the eventList. This is necessary
-        because we the MIDI event stream can become confused otherwise.
+        because we the MIDI event stream can become confused otherwise.  The first
+        of each set of duplicates is the one kept.
         '''
         
-        # For this algorithm to work, the events in the eventList must be hashable 
-        # (that is, they must have a __hash__() and __eq__() function defined).
-        
-        tempDict = {}
+        uniqueEvents = {}
         for item in self.eventList:
-            tempDict[item] = 1
+            uniqueEvents.setdefault(item.identity(), item)
             
-        self.eventList = list(tempDict.keys())
+        self.eventList = list(uniqueEvents.values())
         
-        # Sort on type, them on time. Necessary because keys() has no requirement to return
-        # things in any order.
+        # Sort on time, then on type.
         
-        self.eventList.sort(key=lambda x: (x.type))
-        self.eventList.sort(key=lambda x: (x.time)) #A bit of a hack.
+        self.eventList.sort(key=lambda x: (x.time, x.type))
 
     def closeTrack(self):
         '''Called to close a track before writing
@@ -455,8 +380,8 @@ class MIDITrack:
 
         # Write MIDI close event.
 
-        self.MIDIdata = self.MIDIdata + struct.pack('BBBB',0x00,0xFF, \
-            0x2F,0x00)
+        self.MIDIdata.extend(endOfTrack)
+        self.MIDIdata = bytes(self.MIDIdata)
         
         # Calculate the entire length of the data and write to the header
         
@@ -465,6 +390,9 @@ class MIDITrack:
     def writeEventsToStream(self):
         '''
         Write the events in MIDIEvents to the MIDI stream.
+        
+        The stream is built up in a single bytearray, rather than by concatenating
+        byte strings, so that the time taken grows linearly with the length of the track.
         '''
         preciseTime = 0.0                   # Actual time of event, ignoring round-off
         actualTime = 0.0                    # Time as written to midi stream, include round-off
@@ -472,16 +400,10 @@ class MIDITrack:
 
             preciseTime = preciseTime + event.time
 
-            # Convert the time to variable length and back, to see how much
-            # error is introduced
+            # Times are written rounded to the nearest whole tick (see writeVarLength),
+            # so work out how much error that introduces
 
-            testBuffer = bytes()
-            varTime = writeVarLength(event.time)
-            for timeByte in varTime:
-                testBuffer = testBuffer + struct.pack('>B',timeByte)
-            (roundedVal,discard) = readVarLength(0,testBuffer)
-            roundedTime = actualTime + roundedVal
-            # print "Rounded, Precise: %15.10f %15.10f" % (roundedTime, preciseTime)
+            roundedTime = actualTime + int(event.time + 0.5)
 
             # Calculate the delta between the two and apply it to the event time.
 
@@ -490,104 +412,13 @@ class MIDITrack:
 
             # Now update the actualTime value, using the updated event time.
 
-            testBuffer = bytes()
-            varTime = writeVarLength(event.time)
-            for timeByte in varTime:
-                testBuffer = testBuffer + struct.pack('>B',timeByte)
-            (roundedVal,discard) = readVarLength(0,testBuffer)
-            actualTime = actualTime + roundedVal
+            actualTime = actualTime + int(event.time + 0.5)
         
+        data = bytearray(self.MIDIdata)
         for event in self.MIDIEventList:
-            if event.type == "NoteOn":
-                code = 0x9 << 4 | event.channel
-                varTime = writeVarLength(event.time)
-                for timeByte in varTime:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B',timeByte)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',code)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',event.pitch)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',event.volume)
-            elif event.type == "NoteOff":
-                code = 0x8 << 4 | event.channel
-                varTime = writeVarLength(event.time)
-                for timeByte in varTime:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B',timeByte)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',code)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',event.pitch)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',event.volume)
-            elif event.type == "Tempo":
-                code = 0xFF
-                subcode = 0x51
-                fourbite = struct.pack('>L', event.tempo)
-                threebite = fourbite[1:4]       # Just discard the MSB
-                varTime = writeVarLength(event.time)
-                for timeByte in varTime:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B',timeByte)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',code)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',subcode)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B', 0x03) # Data length: 3
-                self.MIDIdata = self.MIDIdata + threebite
-            elif event.type == 'ProgramChange':
-                code = 0xC << 4 | event.channel
-                varTime = writeVarLength(event.time)
-                for timeByte in varTime:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B',timeByte)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',code)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',event.programNumber)
-            elif event.type == 'TrackName':
-                varTime = writeVarLength(event.time)
-                for timeByte in varTime:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B',timeByte)
-                self.MIDIdata = self.MIDIdata + struct.pack('B',0xFF) # Meta-event
-                self.MIDIdata = self.MIDIdata + struct.pack('B',0X03) # Event Type
-                dataLength = len(event.trackName)
-                dataLenghtVar = writeVarLength(dataLength)
-                for i in range(0,len(dataLenghtVar)):
-                    self.MIDIdata = self.MIDIdata + struct.pack("b",dataLenghtVar[i])
-                self.MIDIdata = self.MIDIdata + event.trackName.encode()
-            elif event.type == "ControllerEvent":
-                code = 0xB << 4 | event.channel
-                varTime = writeVarLength(event.time)
-                for timeByte in varTime:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B',timeByte)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',code)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',event.eventType)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',event.paramerter1)
-            elif event.type == "SysEx":
-                code = 0xF0
-                varTime = writeVarLength(event.time)
-                for timeByte in varTime:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B',timeByte)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B', code)
-                
-                payloadLength = writeVarLength(len(event.payload)+2)
-                for lenByte in payloadLength:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B',lenByte)
-                    
-                self.MIDIdata = self.MIDIdata + struct.pack('>B', event.manID)
-                self.MIDIdata = self.MIDIdata + event.payload
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',0xF7)
-            elif event.type == "UniversalSysEx":
-                code = 0xF0
-                varTime = writeVarLength(event.time)
-                for timeByte in varTime:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B',timeByte)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B', code)
-                
-                # Do we need to add a length?
-                payloadLength = writeVarLength(len(event.payload)+5)
-                for lenByte in payloadLength:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B',lenByte)
-                
-                if event.realTime :
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B', 0x7F)
-                else:
-                    self.MIDIdata = self.MIDIdata + struct.pack('>B', 0x7E)
-                    
-                self.MIDIdata = self.MIDIdata + struct.pack('>B', event.sysExChannel)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B', event.code)
-                self.MIDIdata = self.MIDIdata + struct.pack('>B', event.subcode)
-                self.MIDIdata = self.MIDIdata + event.payload
-                self.MIDIdata = self.MIDIdata + struct.pack('>B',0xF7)
+            data.extend(packVarLength(event.time))
+            eventWriters[event.type](data, event.source)
+        self.MIDIdata = data
         
     def deInterleaveNotes(self):
         '''Correct Interleaved notes.
@@ -595,40 +426,29 @@ class MIDITrack:
         Because we are writing multiple notes in no particular order, we
         can have notes which are interleaved with respect to their start
         and stop times. This method will correct that. It expects that the
-        MIDIEventList has been time-ordered.
+        MIDIEventList has been time-ordered, and leaves it to the caller to
+        put it back in order afterwards.
         '''
         
-        tempEventList = []
+        # Start times of the notes sounding on each pitch and channel
         stack = {}
         
         for event in self.MIDIEventList:
             
             if event.type == 'NoteOn':
-                if str(event.pitch)+str(event.channel) in stack:
-                    stack[str(event.pitch)+str(event.channel)].append(event.time)
+                note = event.source
+                key = note.pitch << 8 | note.channel
+                if key in stack:
+                    stack[key].append(event.time)
                 else:
-                    stack[str(event.pitch)+str(event.channel)] = [event.time]
-                tempEventList.append(event)
+                    stack[key] = [event.time]
             elif event.type == 'NoteOff':
-                if len(stack[str(event.pitch)+str(event.channel)]) > 1:
-                    event.time = stack[str(event.pitch)+str(event.channel)].pop()
-                    tempEventList.append(event)
+                note = event.source
+                startTimes = stack[note.pitch << 8 | note.channel]
+                if len(startTimes) > 1:
+                    event.time = startTimes.pop()
                 else:
-                    stack[str(event.pitch)+str(event.channel)].pop()
-                    tempEventList.append(event)
-            else:
-                tempEventList.append(event)
-                    
-        self.MIDIEventList = tempEventList
-        
-        # A little trickery here. We want to make sure that NoteOff events appear 
-        # before NoteOn events, so we'll do two sorts -- on on type, one on time. 
-        # This may have to be revisited, as it makes assumptions about how 
-        # the internal sort works, and is in essence creating a sort on a primary 
-        # and secondary key.
-        
-        self.MIDIEventList.sort(key=lambda x: (x.type))
-        self.MIDIEventList.sort(key=lambda x: (x.time))
+                    startTimes.pop()
 
     def adjustTime(self,origin):
         '''
@@ -662,6 +482,96 @@ class MIDITrack:
         fileHandle.write(self.MIDIdata)
 
 
+# Functions making the MIDI events for each type of event in the eventList
+
+def makeNoteEvents(MIDIEventList, note):
+    MIDIEventList.append(MIDIEvent("NoteOn", note.time * TICKSPERBEAT, 3, note))
+    MIDIEventList.append(MIDIEvent("NoteOff", (note.time + note.duration) * TICKSPERBEAT, 2, note))
+
+def makeTempoEvents(MIDIEventList, tempo):
+    MIDIEventList.append(MIDIEvent("Tempo", tempo.time * TICKSPERBEAT, 3, tempo))
+
+def makeProgramChangeEvents(MIDIEventList, programChange):
+    MIDIEventList.append(MIDIEvent("ProgramChange", programChange.time * TICKSPERBEAT, 1, programChange))
+
+def makeTrackNameEvents(MIDIEventList, trackName):
+    MIDIEventList.append(MIDIEvent("TrackName", trackName.time * TICKSPERBEAT, 0, trackName))
+
+def makeControllerEvents(MIDIEventList, controllerEvent):
+    MIDIEventList.append(MIDIEvent("ControllerEvent", controllerEvent.time * TICKSPERBEAT, 1, controllerEvent))
+
+def makeSysExEvents(MIDIEventList, sysEx):
+    MIDIEventList.append(MIDIEvent("SysEx", sysEx.time * TICKSPERBEAT, 1, sysEx))
+
+def makeUniversalSysExEvents(MIDIEventList, universalSysEx):
+    MIDIEventList.append(MIDIEvent("UniversalSysEx", universalSysEx.time * TICKSPERBEAT, 1, universalSysEx))
+
+eventMakers = {
+    'note': makeNoteEvents,
+    'tempo': makeTempoEvents,
+    'programChange': makeProgramChangeEvents,
+    'trackName': makeTrackNameEvents,
+    'controllerEvent': makeControllerEvents,
+    'SysEx': makeSysExEvents,
+    'UniversalSysEx': makeUniversalSysExEvents,
+}
+
+# Functions writing each type of MIDI event to the stream, after its time
+
+def writeNoteOn(data, note):
+    data.extend(threeBytes.pack(0x9 << 4 | note.channel, note.pitch, note.volume))
+
+def writeNoteOff(data, note):
+    data.extend(threeBytes.pack(0x8 << 4 | note.channel, note.pitch, note.volume))
+
+def writeTempo(data, tempo):
+    # Meta-event, subtype, data length 3, and the tempo without its MSB
+    data.extend(tempoEvent.pack(0xFF, 0x51, 0x03, tempo.tempo >> 16 & 0xFF, tempo.tempo & 0xFFFF))
+
+def writeProgramChange(data, programChange):
+    data.extend(twoBytes.pack(0xC << 4 | programChange.channel, programChange.programNumber))
+
+def writeTrackName(data, trackName):
+    encodedName = trackName.trackName.encode()
+    data.extend(twoBytes.pack(0xFF, 0x03)) # Meta-event, event type
+    data.extend(packVarLength(len(encodedName)))
+    data.extend(encodedName)
+
+def writeControllerEvent(data, controllerEvent):
+    data.extend(threeBytes.pack(0xB << 4 | controllerEvent.channel, controllerEvent.eventType,
+                                controllerEvent.parameter1))
+
+def writeSysEx(data, sysEx):
+    data.append(0xF0)
+    data.extend(packVarLength(len(sysEx.payload)+2))
+    data.append(sysEx.manID)
+    data.extend(sysEx.payload)
+    data.append(0xF7)
+
+def writeUniversalSysEx(data, universalSysEx):
+    data.append(0xF0)
+    # Do we need to add a length?
+    data.extend(packVarLength(len(universalSysEx.payload)+5))
+    if universalSysEx.realTime :
+        realTimeCode = 0x7F
+    else:
+        realTimeCode = 0x7E
+    data.extend(fourBytes.pack(realTimeCode, universalSysEx.sysExChannel, universalSysEx.code,
+                               universalSysEx.subcode))
+    data.extend(universalSysEx.payload)
+    data.append(0xF7)
+
+eventWriters = {
+    'NoteOn': writeNoteOn,
+    'NoteOff': writeNoteOff,
+    'Tempo': writeTempo,
+    'ProgramChange': writeProgramChange,
+    'TrackName': writeTrackName,
+    'ControllerEvent': writeControllerEvent,
+    'SysEx': writeSysEx,
+    'UniversalSysEx': writeUniversalSysEx,
+}
+
 class MIDIHeader:
     '''
     Class to encapsulate the MIDI header structure.
@@ -854,6 +764,18 @@ class MIDIFile:
         for i in range(0,self.numTracks):
             self.tracks[i].writeTrack(fileHandle)
 
+    def to_bytes(self):
+        '''
+        Return the MIDI File as bytes, exactly as writeFile would write it.
+        
+        Use:
+            MyMIDI.to_bytes()
+        '''
+        
+        stream = io.BytesIO()
+        self.writeFile(stream)
+        return stream.getvalue()
+
     def addSysEx(self,track, time, manID, payload):
         """
         Add a SysEx event
@@ -943,11 +865,9 @@ class MIDIFile:
         if self.closed == True:
             return
                 
+        # Closing a track puts its MIDI events in order of time, then ordinality
         for i in range(0,self.numTracks):
             self.tracks[i].closeTrack()
-            # We want things like program changes to come before notes when they are at the
-            # same time, so we sort the MIDI events by their ordinality
-            self.tracks[i].MIDIEventList.sort()
             
         origin = self.findOrigin()
 
@@ -1004,6 +924,24 @@ def writeVarLength(i):
     reversed[3] = output[0]
     return reversed[4-count:4]
     
+def packVarLength(i):
+    '''Accept an input, and return it packed as a MIDI-compatible variable length
+    quantity, as bytes. 
+    
+    Gives the same result as packing each byte from writeVarLength, but without
+    building up the intermediate lists.
+    '''
+    input = int(i+0.5)
+    if input < 0x80:
+        return bytes((input & 0x7F,))
+    output = bytearray((input & 0x7F,))
+    input = input >> 7
+    while input > 0:
+        output.append(input & 0x7F | 0x80)
+        input = input >> 7
+    output.reverse()
+    return bytes(output)
+
 def readVarLength(offset, buffer):
     '''A function to read a MIDI variable length variable.
 
@@ -1012,16 +950,103 @@ def readVarLength(offset, buffer):
     '''
     toffset = offset
     output = 0
-    bytesRead = 0
     while True:
-        output = output << 7
-        byte = struct.unpack_from('>B',buffer,toffset)[0]
+        byte = buffer[toffset]
         toffset = toffset + 1
-        bytesRead = bytesRead + 1
-        output = output + (byte & 127)
+        output = (output << 7) + (byte & 127)
         if (byte & 128) == 0:
             break
-    return (output, bytesRead)
+    return (output, toffset - offset)
+
+def readMIDIHeader(buffer):
+    '''Read the header of a MIDI file.
+    
+    Returns a tuple of the format, number of tracks and ticks per beat.
+    '''
+    chunkType, chunkLength = chunkHeader.unpack_from(buffer, 0)
+    if chunkType != b'MThd':
+        raise ValueError("Not a MIDI file: it doesn't start with a header chunk")
+    return fileHeader.unpack_from(buffer, 8)
+
+def iterNoteEvents(buffer):
+    '''Read the note events from a MIDI file held in a buffer.
+    
+    The buffer can be anything indexable by byte, such as bytes or an mmap. Rather
+    than building an object for each event, this yields a tuple of:
+    
+        (track, time, noteOn, channel, pitch, velocity)
+    
+    for each note on or note off event, in the order they're in the file, where
+    track counts the track chunks from 0, time is in ticks from the start of the
+    track, and noteOn is False for note off events (including note ons with a
+    velocity of 0). Everything else is skipped over.
+    '''
+    length = len(buffer)
+    offset = 0
+    track = -1
+    while offset + chunkHeader.size <= length:
+        chunkType, chunkLength = chunkHeader.unpack_from(buffer, offset)
+        offset = offset + chunkHeader.size
+        chunkEnd = offset + chunkLength
+        if chunkType != b'MTrk':
+            offset = chunkEnd
+            continue
+        
+        track = track + 1
+        time = 0
+        status = 0
+        while offset < chunkEnd:
+            # Delta time, which is nearly always a single byte
+            byte = buffer[offset]
+            if byte < 0x80:
+                time = time + byte
+                offset = offset + 1
+            else:
+                delta, bytesRead = readVarLength(offset, buffer)
+                time = time + delta
+                offset = offset + bytesRead
+            
+            # Status byte, unless it's the same as last time (running status)
+            byte = buffer[offset]
+            if byte >= 0x80:
+                status = byte
+                offset = offset + 1
+            elif status == 0:
+                raise ValueError("Data byte without a status byte at offset {0}".format(offset))
+            
+            kind = status >> 4
+            if kind == 0x9 or kind == 0x8:
+                pitch = buffer[offset]
+                velocity = buffer[offset + 1]
+                offset = offset + 2
+                yield (track, time, kind == 0x9 and velocity > 0, status & 0x0F, pitch, velocity)
+            elif kind == 0xC or kind == 0xD:
+                offset = offset + 1
+            elif kind != 0xF:
+                offset = offset + 2
+            elif status == 0xFF:
+                # Meta-event: event type, then the length of the data
+                dataLength, bytesRead = readVarLength(offset + 1, buffer)
+                offset = offset + 1 + bytesRead + dataLength
+                status = 0
+            else:
+                # SysEx: the length of the data
+                dataLength, bytesRead = readVarLength(offset, buffer)
+                offset = offset + bytesRead + dataLength
+                status = 0
+        offset = chunkEnd
+
+def readNoteEvents(fileName):
+    '''Read the note events from a MIDI file, as iterNoteEvents does.
+    
+    The file is memory-mapped rather than read in, so large files can be streamed
+    through without holding them in memory.
+    '''
+    with open(fileName, 'rb') as fileHandle:
+        if os.fstat(fileHandle.fileno()).st_size == 0:
+            return
+        with mmap.mmap(fileHandle.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            yield from iterNoteEvents(buffer)
 
 def frequencyTransform(freq):
     '''Returns a three-byte transform of a frequencyTransform
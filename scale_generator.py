@@ -12,10 +12,15 @@ See README.md for a better explanation.
 """
 
 import argparse
+from contextlib import ExitStack
 
-from scale_generator.filtering import *
+# This is run thousands of times at a go, so only what every run needs is imported here, and everything else is
+# imported when an option needs it.  The budget for `--count` is 40 ms of imports (as `python -X importtime` counts
+# them), without midiutil, multiprocessing, numpy or scale_generator.pipeline.  Check with `python check_startup.py`.
+from scale_generator.counting import *
+from scale_generator.distance_metrics import *
+from scale_generator.layouts import *
 from scale_generator.printing import *
-from scale_generator.midi import *
 
 
 def main():
@@ -23,9 +28,90 @@ def main():
 	# Parse command line args
 	parser = argparse.ArgumentParser()
 
+	parser.add_argument(
+		"--octave",
+		help="The number of semitones in an octave.",
+		type=int,
+		default=OCTAVE)
+	parser.add_argument(
+		"--count",
+		help="Just count the scales of each length, without listing them.",
+		action="store_true")
+	parser.add_argument(
+		"--lookup",
+		help="Rather than listing scales, describe one, given by its intervals (e.g. \"2 2 1 2 2 2 1\"): its number in "
+			 "the list, its modes, and which filters would remove it.",
+		metavar="INTERVALS")
+	parser.add_argument(
+		"--sample",
+		help="List this many scales picked uniformly at random, rather than all of them.",
+		type=int)
+	parser.add_argument(
+		"--seed",
+		help="Seed for picking random scales with --sample.",
+		type=int)
 	parser.add_argument(
 		"--save_midi_to",
 		help="The path to save midi files to.")
+	parser.add_argument(
+		"--midi_layout",
+		help="How to arrange MIDI files saved with --save_midi_to: all in one directory, named after the interval list "
+			 "(flat), or spread over subdirectories, named after the scale's bitmask (sharded).",
+		choices=MIDI_LAYOUTS,
+		default=FLAT_LAYOUT)
+	parser.add_argument(
+		"--midi_manifest",
+		help="Write a manifest listing the MIDI files saved with --save_midi_to (always done for the sharded layout).",
+		action="store_true")
+	parser.add_argument(
+		"--midi_incremental",
+		help="Only save MIDI files with --save_midi_to which are new or changed since the last time (using the manifest).",
+		action="store_true")
+	parser.add_argument(
+		"--midi_delete_stale",
+		help="Delete MIDI files saved with --save_midi_to last time (according to the manifest) which aren't saved this "
+			 "time.",
+		action="store_true")
+	parser.add_argument(
+		"--starting_note",
+		help="The MIDI note number to start scales on in MIDI files.  69 is middle A.",
+		type=int,
+		default=69)
+	parser.add_argument(
+		"--tempo_bpm",
+		help="The tempo of MIDI files, in beats per minute.",
+		type=int,
+		default=120)
+	parser.add_argument(
+		"--microtonal",
+		help="Tune MIDI files saved with --save_midi_to or --save_midi_archive to the equal temperament of --octave, "
+			 "using MIDI Tuning Standard messages, rather than playing each step as a semitone.",
+		action="store_true")
+	parser.add_argument(
+		"--save_midi_archive",
+		help="A .zip, .tar or .tar.gz archive to save all the MIDI files into, with a manifest.")
+	parser.add_argument(
+		"--midi_archive_deflate",
+		help="Compress MIDI files saved into a .zip archive, rather than just storing them.",
+		action="store_true")
+	parser.add_argument(
+		"--save_midi_multitrack",
+		help="A MIDI file to save every scale into, each as its own track.")
+	parser.add_argument(
+		"--save_midi_sequence",
+		help="A MIDI file to save every scale into, one after another in a single track, with markers.")
+	parser.add_argument(
+		"--midi_workers",
+		help="The number of processes to save MIDI files in.",
+		type=int,
+		default=1)
+	parser.add_argument(
+		"--verbose_midi",
+		help="Log progress while saving MIDI files.",
+		action="store_true")
+	parser.add_argument(
+		"--save_wav_to",
+		help="The path to save WAV files to, tuned to the equal temperament of --octave.  Needs NumPy.")
 	parser.add_argument(
 		"--filter_modes",
 		help="Filter out different modes (cyclic permutations) of scales in the list.",
@@ -46,6 +132,49 @@ def main():
 		"--min_length",
 		help="The shortest permitted length of scale.",
 		type=int)
+	parser.add_argument(
+		"--workers",
+		help="The number of processes to generate and filter scales in.",
+		type=int,
+		default=1)
+	parser.add_argument(
+		"--checkpoint",
+		help="A file to save progress to while generating and filtering, so it can be resumed after a crash.")
+	parser.add_argument(
+		"--resume",
+		help="Resume from the progress saved with --checkpoint (and by --save_distances), rather than starting again.",
+		action="store_true")
+	parser.add_argument(
+		"--serve",
+		help="Rather than listing scales, answer queries about them over HTTP on this port (see server.py).",
+		type=int,
+		metavar="PORT")
+	parser.add_argument(
+		"--host",
+		help="The address to answer queries on with --serve.  Only this machine, by default.",
+		default="127.0.0.1")
+	parser.add_argument(
+		"--save_subscale_graph",
+		help="Rather than listing scales, save the graph of which scales are subscales of which to this file (see "
+			 "subscale_graph.py).  Scales are filtered by --filter_chromatic_triplets, --max_interval and --min_length.",
+		metavar="FILE")
+	parser.add_argument(
+		"--export_graph",
+		help="Rather than listing scales, write the graph of subscales and modes to this file, as GraphML (.graphml), "
+			 "GEXF (.gexf) or an edge list (.tsv) (see graph_export.py).  Scales are filtered by "
+			 "--filter_chromatic_triplets, --max_interval and --min_length.",
+		metavar="FILE")
+	parser.add_argument(
+		"--save_distances",
+		help="Rather than listing scales, save the distance between every pair of them to this .npy file, as a matrix "
+			 "(see distances.py).  Needs NumPy.",
+		metavar="FILE")
+	parser.add_argument(
+		"--distance_metric",
+		help="How to measure distances with --save_distances: hamming (the number of notes in one scale but not the "
+			 "other), interval_vector, or voice_leading.",
+		choices=DISTANCE_METRICS,
+		default=HAMMING_DISTANCE)
 	parser.add_argument(
 		"--verbose_filtering",
 		help="Display each scale as it is removed, and explain why.",
@@ -53,37 +182,240 @@ def main():
 
 	args = parser.parse_args()
 
-	# TODO: Simplify copying.
+	if args.resume and not (args.checkpoint or args.save_distances):
+		parser.error("--resume needs a --checkpoint or --save_distances to resume from.")
+	if args.resume and args.checkpoint:
+		# Checked now, rather than once the list has been worked out up to where the checkpoint is used
+		from scale_generator.pipeline import check_checkpoint
+		try:
+			check_checkpoint(args.checkpoint,
+							 octave=args.octave,
+							 chromatic_triplets=args.filter_chromatic_triplets,
+							 max_interval=args.max_interval,
+							 min_length=args.min_length)
+		except ValueError as error:
+			parser.error(str(error))
+	# Tunings apply to the whole instrument, so only make sense one scale to a file.
+	if args.microtonal and (args.save_midi_multitrack or args.save_midi_sequence):
+		parser.error("--microtonal can't be used with --save_midi_multitrack or --save_midi_sequence.")
+	if not 0 <= args.starting_note <= 127:
+		parser.error("--starting_note must be a MIDI note number, between 0 and 127.")
+	if args.tempo_bpm <= 0:
+		parser.error("--tempo_bpm must be more than 0.")
+
+	# Counting doesn't need any scales to be listed, so is fast for any size of octave.
+	if args.count:
+		display_scale_counts(count_scales_by_length(
+			args.octave,
+			min_length=args.min_length,
+			max_interval=args.max_interval,
+			chromatic_triplets=args.filter_chromatic_triplets,
+			subscales=args.filter_subscales,
+			modes=args.filter_modes))
+		return
+
+	if args.lookup is not None:
+		from scale_generator.lookup import display_scale_lookup, parse_scale
+		try:
+			scale = parse_scale(args.lookup, args.octave)
+		except ValueError as error:
+			parser.error(str(error))
+		display_scale_lookup(scale)
+		return
 
-	# First list all partitions of the octave, this is "all scales", but may have many repeats and have multiple
-	# instances of things we don't want, such as chromatic triplets.
-	list_of_scales = list_all_scales()
+	if args.serve is not None:
+		# Only needed when serving
+		from scale_generator.server import ScaleCatalog, serve
+		prints("Building catalog...")
+		catalog = ScaleCatalog(
+			octave=args.octave,
+			chromatic_triplets=args.filter_chromatic_triplets,
+			subscales=args.filter_subscales,
+			modes=args.filter_modes,
+			max_interval=args.max_interval,
+			min_length=args.min_length,
+			workers=args.workers)
+		serve(catalog, args.serve, host=args.host, workers=args.workers)
+		return
+
+	if args.save_subscale_graph:
+		# The graph is what the subscale filter works out, so it's of the list before that (and the mode) filter
+		if args.filter_modes or args.filter_subscales:
+			parser.error("--save_subscale_graph can't be used with --filter_modes or --filter_subscales.")
+		from scale_generator.pipeline import filtered_scale_buckets
+		from scale_generator.subscale_graph import build_subscale_graph
+		prints("Building subscale graph...")
+		graph = build_subscale_graph(
+			[scale
+			 for bucket in filtered_scale_buckets(octave=args.octave,
+												  chromatic_triplets=args.filter_chromatic_triplets,
+												  max_interval=args.max_interval,
+												  min_length=args.min_length,
+												  workers=args.workers)
+			 for scale in bucket],
+			octave=args.octave)
+		graph.save(args.save_subscale_graph)
+		prints("Saved {0} scales and {1} edges.".format(len(graph), graph.edge_count))
+		return
+
+	if args.export_graph:
+		# The graph shows what the subscale and mode filters work from, so it's of the list before those filters
+		if args.filter_modes or args.filter_subscales:
+			parser.error("--export_graph can't be used with --filter_modes or --filter_subscales.")
+		from scale_generator.graph_export import export_scale_graph
+		prints("Exporting graph...")
+		try:
+			node_count, edge_count = export_scale_graph(
+				args.export_graph,
+				octave=args.octave,
+				chromatic_triplets=args.filter_chromatic_triplets,
+				max_interval=args.max_interval,
+				min_length=args.min_length)
+		except ValueError as error:
+			parser.error(str(error))
+		prints("Exported {0} scales and {1} edges.".format(node_count, edge_count))
+		return
+
+	if args.save_distances:
+		# Only needs NumPy if asked for
+		from scale_generator.distances import save_distance_matrix
+		from scale_generator.pipeline import filtered_scale_buckets
+		scales = [scale
+				  for bucket in filtered_scale_buckets(octave=args.octave,
+													   chromatic_triplets=args.filter_chromatic_triplets,
+													   subscales=args.filter_subscales,
+													   modes=args.filter_modes,
+													   max_interval=args.max_interval,
+													   min_length=args.min_length,
+													   workers=args.workers,
+													   checkpoint_path=args.checkpoint,
+													   resume=args.resume)
+				  for scale in bucket]
+		prints("Saving distances between {0} scales...".format(len(scales)))
+		try:
+			save_distance_matrix(scales, args.save_distances,
+								 metric=args.distance_metric,
+								 octave=args.octave,
+								 workers=args.workers,
+								 resume=args.resume,
+								 verbose=True)
+		except ValueError as error:
+			parser.error(str(error))
+		return
+
+	# TODO: Simplify copying.
 
-	# Sort by length
-	list_of_scales = sorted(list_of_scales, key=lambda l: len(l))
+	if args.sample is not None:
+		# Modes and subscales are defined relative to the rest of the list, so can't be applied to a sample.
+		if args.filter_modes or args.filter_subscales:
+			parser.error("--sample can't be used with --filter_modes or --filter_subscales.")
+		scale_buckets = [sample(
+			args.sample,
+			octave=args.octave,
+			min_length=args.min_length,
+			max_interval=args.max_interval,
+			chromatic_triplets=args.filter_chromatic_triplets,
+			seed=args.seed)]
 
-	# Apply filters
-	if args.filter_chromatic_triplets:
-		list_of_scales = filter_by_chromatic_triples(list_of_scales, verbose=args.verbose_filtering)
+	else:
+		from scale_generator.catalog import ScaleInterner
+		from scale_generator.pipeline import filtered_scale_buckets
+		# Scales are generated and filtered one length at a time, shortest first, so the list comes out already ordered
+		# by length, and (unless we're filtering subscales) we never need to hold more than one length's worth of scales.
+		scale_buckets = filtered_scale_buckets(
+			octave=args.octave,
+			chromatic_triplets=args.filter_chromatic_triplets,
+			subscales=args.filter_subscales,
+			modes=args.filter_modes,
+			max_interval=args.max_interval,
+			min_length=args.min_length,
+			verbose=args.verbose_filtering,
+			workers=args.workers,
+			checkpoint_path=args.checkpoint,
+			resume=args.resume,
+			# The subscale filter holds the whole list and looks scales up in it, so it's worth sharing one object for each
+			# scale.  Otherwise lists are lighter and quicker to make.
+			interner=ScaleInterner() if args.filter_subscales else None)
 
-	if args.filter_subscales:
-		list_of_scales = filter_subscales(list_of_scales, verbose=args.verbose_filtering)
+	# MIDI and WAV files are saved as we go.  However we stop, they're closed, so what's been saved so far is usable.
+	tuning_octave = args.octave if args.microtonal else None
+	scale_collections = []
+	with ExitStack() as open_collections:
+		if args.save_midi_to or args.save_midi_archive or args.save_midi_multitrack or args.save_midi_sequence:
+			from scale_generator.midi import MidiArchive, MidiDirectory, MidiSequenceFile, MultitrackMidiFile
+		# The archive and the multitrack file can turn down what they're asked for, so are opened first, before any
+		# files are saved
+		if args.save_midi_archive:
+			try:
+				scale_collections.append(open_collections.enter_context(MidiArchive(
+					args.save_midi_archive,
+					deflate=args.midi_archive_deflate,
+					starting_note=args.starting_note,
+					tempo_bpm=args.tempo_bpm,
+					tuning_octave=tuning_octave)))
+			except ValueError as error:
+				parser.error(str(error))
+		if args.save_midi_multitrack:
+			# Counted first, so a list too long for one file is turned down before anything's saved.  A sample is
+			# drawn with replacement, so always has as many scales as asked for.
+			if args.sample is not None:
+				scale_count = args.sample
+			else:
+				scale_count = count_scales(
+					args.octave,
+					min_length=args.min_length,
+					max_interval=args.max_interval,
+					chromatic_triplets=args.filter_chromatic_triplets,
+					subscales=args.filter_subscales,
+					modes=args.filter_modes)
+			try:
+				scale_collections.append(open_collections.enter_context(MultitrackMidiFile(
+					args.save_midi_multitrack,
+					starting_note=args.starting_note,
+					tempo_bpm=args.tempo_bpm,
+					scale_count=scale_count)))
+			except ValueError as error:
+				parser.error(str(error))
+		if args.save_midi_to:
+			scale_collections.append(open_collections.enter_context(MidiDirectory(
+				args.save_midi_to,
+				layout=args.midi_layout,
+				manifest=args.midi_manifest or args.midi_layout == SHARDED_LAYOUT,
+				workers=args.midi_workers,
+				verbose=args.verbose_midi,
+				starting_note=args.starting_note,
+				tempo_bpm=args.tempo_bpm,
+				tuning_octave=tuning_octave,
+				incremental=args.midi_incremental,
+				delete_stale=args.midi_delete_stale)))
+		if args.save_midi_sequence:
+			scale_collections.append(open_collections.enter_context(MidiSequenceFile(
+				args.save_midi_sequence,
+				starting_note=args.starting_note,
+				tempo_bpm=args.tempo_bpm)))
 
-	if args.filter_modes:
-		list_of_scales = filter_modes(list_of_scales, verbose=args.verbose_filtering)
+		if args.save_wav_to:
+			# Only needs NumPy if asked for
+			from scale_generator.audio import WavDirectory
+			scale_collections.append(open_collections.enter_context(WavDirectory(
+				args.save_wav_to,
+				octave=args.octave,
+				starting_note=args.starting_note,
+				tempo_bpm=args.tempo_bpm,
+				verbose=args.verbose_midi)))
 
-	if args.max_interval and args.max_interval > 0:
-		list_of_scales = filter_by_maximum_interval(list_of_scales, max_permitted_interval=args.max_interval, verbose=args.verbose_filtering)
+		prints()
+		prints("Listing scales...")
 
-	if args.min_length and args.min_length > 0:
-		list_of_scales = filter_by_length(list_of_scales, minimum=args.min_length, verbose=args.verbose_filtering)
+		scale_number = 1
+		for list_of_scales in scale_buckets:
 
-	# Save
-	if args.save_midi_to:
-		save_scales_as_midi(list_of_scales, args.save_midi_to)
+			# Save
+			for scale_collection in scale_collections:
+				scale_collection.save_scales(list_of_scales)
 
-	# Display the list of scales
-	display_scales(list_of_scales)
+			# Display the list of scales
+			scale_number = display_scale_entries(list_of_scales, start_number=scale_number)
 
 
 if __name__ == "__main__":
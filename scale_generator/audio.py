@@ -0,0 +1,190 @@
+# coding=utf-8
+"""
+Code relating to rendering scales as audio, in WAV files.
+
+Needs NumPy.  Scales are played with the same timing as intervals_to_midifile: each note starts a beat after the one
+before, and lasts a beat.  Each note is a sum of harmonics at exactly the frequency of its step of the equal
+temperament, faded in and out so notes don't click.
+
+Scales are rendered in batches, one note at a time for every scale in the batch at once, and each note is written out
+as soon as it's made, so only one note of each scale in a batch is ever held in memory.
+"""
+
+import os
+import wave
+
+import numpy
+
+from scale_generator.printing import *
+
+# Samples per second
+SAMPLE_RATE = 44100
+
+# How many scales to render at once
+WAV_BATCH_SIZE = 64
+
+# The relative amplitude of each harmonic of a note, starting with the fundamental
+HARMONICS = [1.0, 0.5, 0.25, 0.125]
+
+# The loudest any sample can be, as a fraction of full scale
+AMPLITUDE = 0.5
+
+# How long it takes a note to fade in and out, in seconds
+FADE_SECONDS = 0.01
+
+# Bytes per sample (16-bit audio)
+_SAMPLE_WIDTH = 2
+_FULL_SCALE = 2 ** 15 - 1
+
+
+def save_scales_as_wav(list_of_scales, save_path, octave=OCTAVE, starting_note=69, tempo_bpm=120,
+					   sample_rate=SAMPLE_RATE, verbose=False):
+	"""
+	Saves a WAV file for each scale.
+	:param list_of_scales:
+	:param save_path:
+	:param octave: The number of equal steps in the octave.
+	:param starting_note: The MIDI note to start scales on.  69 is middle A
+	:param tempo_bpm:
+	:param sample_rate:
+	:param verbose: Log each batch of files as it's saved.
+	:return:
+	"""
+	note_length = int(round(sample_rate * 60 / tempo_bpm))
+	envelope = _envelope(note_length, int(round(sample_rate * FADE_SECONDS)))
+
+	for batch_start in range(0, len(list_of_scales), WAV_BATCH_SIZE):
+		batch = list_of_scales[batch_start:batch_start + WAV_BATCH_SIZE]
+		_save_wav_batch(batch, save_path, octave, starting_note, sample_rate, note_length, envelope)
+		if verbose:
+			prints("Saved {0} of {1} WAV files.".format(batch_start + len(batch), len(list_of_scales)))
+
+
+def wav_file_path(scale):
+	"""
+	The name of a scale's WAV file.
+	:param scale:
+	:return:
+	"""
+	return "scale-{0}.wav".format(scale)
+
+
+def scale_frequencies(scale, octave=OCTAVE, starting_note=69):
+	"""
+	The frequency of each note of a scale, in Hz, in an equal temperament.
+	:param scale:
+	:param octave: The number of equal steps in the octave.
+	:param starting_note: The MIDI note the scale starts on.  69 is middle A
+	:return: An array with a frequency for each note, including the octave at the top.
+	"""
+	steps = numpy.concatenate(([0], numpy.cumsum(scale)))
+	root_frequency = 440.0 * 2.0 ** ((starting_note - 69) / 12)
+	return root_frequency * 2.0 ** (steps / octave)
+
+
+def _save_wav_batch(batch, save_path, octave, starting_note, sample_rate, note_length, envelope):
+	"""
+	Saves WAV files for a batch of scales, a note at a time.
+	"""
+	frequencies = [scale_frequencies(scale, octave, starting_note) for scale in batch]
+	note_counts = numpy.array([len(scale_frequencies) for scale_frequencies in frequencies])
+
+	wav_files = []
+	try:
+		for scale in batch:
+			wav_file = wave.open(os.path.join(save_path, wav_file_path(scale)), "wb")
+			wav_files.append(wav_file)
+			wav_file.setnchannels(1)
+			wav_file.setsampwidth(_SAMPLE_WIDTH)
+			wav_file.setframerate(sample_rate)
+
+		for note_i in range(note_counts.max()):
+			# The scales in the batch which are long enough to have this note
+			playing = numpy.flatnonzero(note_counts > note_i)
+			note_frequencies = numpy.array([frequencies[scale_i][note_i] for scale_i in playing])
+			samples = _note_samples(note_frequencies, note_length, sample_rate) * envelope
+			frames = numpy.round(samples * _FULL_SCALE).astype("<i2")
+			for row, scale_i in enumerate(playing):
+				wav_files[scale_i].writeframes(frames[row].tobytes())
+	finally:
+		for wav_file in wav_files:
+			wav_file.close()
+
+
+def _note_samples(frequencies, note_length, sample_rate):
+	"""
+	A note at each of the frequencies, as an array with a row of samples for each.
+	"""
+	times = numpy.arange(note_length) / sample_rate
+	samples = numpy.zeros((len(frequencies), note_length))
+	for harmonic_i, harmonic_amplitude in enumerate(HARMONICS):
+		harmonic_frequencies = frequencies * (harmonic_i + 1)
+		# Harmonics above the Nyquist frequency would alias back down as noise
+		harmonic_amplitudes = numpy.where(harmonic_frequencies < sample_rate / 2, harmonic_amplitude, 0.0)
+		samples += harmonic_amplitudes[:, numpy.newaxis] * numpy.sin(
+			2 * numpy.pi * harmonic_frequencies[:, numpy.newaxis] * times)
+	return samples * (AMPLITUDE / sum(HARMONICS))
+
+
+def _envelope(note_length, fade_length):
+	"""
+	The amplitude envelope of a note: fading in, holding, then fading out.
+	"""
+	fade_length = min(fade_length, note_length // 2)
+	envelope = numpy.ones(note_length)
+	if fade_length > 0:
+		fade = numpy.linspace(0.0, 1.0, fade_length, endpoint=False)
+		envelope[:fade_length] = fade
+		envelope[note_length - fade_length:] = fade[::-1]
+	return envelope
+
+
+class WavDirectory:
+	"""
+	Saves WAV files for scales into a directory, a list at a time.
+	"""
+
+	def __init__(self, save_path, octave=OCTAVE, starting_note=69, tempo_bpm=120, sample_rate=SAMPLE_RATE,
+				 verbose=False):
+		"""
+		:param save_path:
+		:param octave: The number of equal steps in the octave.
+		:param starting_note:
+		:param tempo_bpm:
+		:param sample_rate:
+		:param verbose: Log progress.
+		"""
+		self.save_path = save_path
+		self.octave = octave
+		self.starting_note = starting_note
+		self.tempo_bpm = tempo_bpm
+		self.sample_rate = sample_rate
+		self.verbose = verbose
+
+		os.makedirs(save_path, exist_ok=True)
+
+	def save_scales(self, list_of_scales):
+		"""
+		Saves WAV files for a list of scales.
+		:param list_of_scales:
+		:return:
+		"""
+		save_scales_as_wav(list_of_scales, self.save_path,
+						   octave=self.octave,
+						   starting_note=self.starting_note,
+						   tempo_bpm=self.tempo_bpm,
+						   sample_rate=self.sample_rate,
+						   verbose=self.verbose)
+
+	def close(self):
+		"""
+		Nothing is held open between lists of scales.
+		:return:
+		"""
+		pass
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
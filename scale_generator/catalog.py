@@ -0,0 +1,211 @@
+# coding=utf-8
+"""
+Code relating to representing scales as objects which remember things worked out about them.
+
+A Scale can be used wherever a list of intervals is (it iterates, indexes, slices to lists, compares equal to lists and
+prints the same), except that it can't be changed.  Things derived from it which are slow to work out, like its modes,
+are only worked out the first time they're asked for.
+
+Scales should come from a ScaleInterner, which hands out one object for each different scale, so that the same scale
+kept by several filtering stages is only held once.
+"""
+
+import weakref
+
+from scale_generator.comparison import *
+from scale_generator.printing import *
+
+
+class Scale:
+	"""
+	An unchangeable scale, with its derived properties cached.
+	"""
+
+	# Kept to a minimum, so a Scale is lighter than the list of intervals it stands in for: the intervals are packed into
+	# bytes, and only the things which are slow to work out, or asked for over and over, are cached.
+	__slots__ = ("_intervals", "_rotations", "_canonical_mode", "_most_major_mode", "_note_list")
+
+	# Scales from a ScaleInterner are of a subclass of its own, which sets this to a weak reference to it, so that
+	# their most major modes can come from it too without each Scale holding on to it
+	_interner = None
+
+	def __init__(self, intervals):
+		"""
+		:param intervals: A list of intervals.
+		"""
+		self._intervals = _packed_intervals(intervals)
+		self._rotations = None
+		self._canonical_mode = None
+		self._most_major_mode = None
+		self._note_list = None
+
+	def __len__(self):
+		return len(self._intervals)
+
+	def __iter__(self):
+		return iter(self._intervals)
+
+	def __getitem__(self, index):
+		# Slices come back as lists, so they can be added to lists to build new scales
+		if isinstance(index, slice):
+			return list(self._intervals[index])
+		return self._intervals[index]
+
+	def __eq__(self, other):
+		if isinstance(other, Scale):
+			return self._intervals == other._intervals
+		if isinstance(other, (list, tuple)):
+			return self.intervals == tuple(other)
+		return NotImplemented
+
+	def __hash__(self):
+		# The same as the tuple of intervals, so tuples can be looked up among Scales
+		return hash(self.intervals)
+
+	def __str__(self):
+		return str(list(self._intervals))
+
+	def __repr__(self):
+		return str(self)
+
+	def __reduce__(self):
+		return Scale, (self.intervals,)
+
+	def copy(self):
+		"""
+		Scales can't be changed, so a copy may as well be the same object.
+		:return:
+		"""
+		return self
+
+	@property
+	def intervals(self):
+		"""
+		The intervals of the scale, as a tuple.
+		"""
+		return tuple(self._intervals)
+
+	@property
+	def mask(self):
+		"""
+		The notes of the scale, as given by scale_to_mask.
+		"""
+		return scale_to_mask(self._intervals)
+
+	@property
+	def note_list(self):
+		"""
+		The names of the notes of the scale, as given by scale_to_note_list_str.
+		"""
+		if self._note_list is None:
+			self._note_list = scale_to_note_list_str(self.intervals)
+		return self._note_list
+
+	@property
+	def rotations(self):
+		"""
+		The different modes of the scale as tuples, starting with the scale itself, in the order you reach them by
+		starting on each note in turn.
+		"""
+		if self._rotations is None:
+			intervals = self.intervals
+			rotations = []
+			for shift in range(len(intervals)):
+				rotation = intervals[shift:] + intervals[:shift]
+				if rotation not in rotations:
+					rotations.append(rotation)
+			self._rotations = tuple(rotations)
+		return self._rotations
+
+	@property
+	def canonical_mode(self):
+		"""
+		The mode which comes first in the listing, as a tuple.  Two scales are modes of each other exactly when they have
+		the same canonical mode.
+		"""
+		if self._canonical_mode is None:
+			self._canonical_mode = canonical_mode(self.intervals)
+		return self._canonical_mode
+
+	@property
+	def score(self):
+		"""
+		How major the scale is, as given by majority_score.
+		"""
+		return majority_score(self.intervals)
+
+	@property
+	def most_major_mode(self):
+		"""
+		The most major mode of the scale, as given by most_major_mode, as a Scale.
+		"""
+		if self._most_major_mode is None:
+			mode = most_major_mode(list(self._intervals))
+			interner = self._interner() if self._interner is not None else None
+			if self == mode:
+				self._most_major_mode = self
+			elif interner is not None:
+				self._most_major_mode = interner.intern(mode)
+			else:
+				self._most_major_mode = Scale(mode)
+		return self._most_major_mode
+
+
+class ScaleInterner:
+	"""
+	Hands out a single Scale object for each different scale.
+	Scales are remembered until the interner is thrown away, or told to forget them with retain, so that Scales needn't
+	carry anything extra to be remembered by.
+	"""
+
+	def __init__(self):
+		self._scales = {}
+		# The class of the Scales it hands out (see Scale._interner)
+		self._scale_class = type("Scale", (Scale,), {"__slots__": (), "_interner": weakref.ref(self)})
+
+	def __len__(self):
+		return len(self._scales)
+
+	def intern(self, intervals):
+		"""
+		The Scale with these intervals.
+		:param intervals: A list of intervals, or a Scale.
+		:return:
+		"""
+		if isinstance(intervals, Scale):
+			key = intervals._intervals
+		else:
+			key = _packed_intervals(intervals)
+		scale = self._scales.get(key)
+		if scale is None:
+			scale = intervals if type(intervals) is self._scale_class else self._scale_class(key)
+			self._scales[key] = scale
+		return scale
+
+	def intern_all(self, list_of_scales):
+		"""
+		The Scales for each of a list of scales.
+		:param list_of_scales:
+		:return:
+		"""
+		return [self.intern(scale) for scale in list_of_scales]
+
+	def retain(self, list_of_scales):
+		"""
+		Forgets every scale but these, so scales thrown away by a filter can be freed.
+		:param list_of_scales: Scales from this interner.
+		:return:
+		"""
+		self._scales = {scale._intervals: scale for scale in list_of_scales}
+
+
+def _packed_intervals(intervals):
+	"""
+	Intervals as bytes, one per interval, or as a tuple if any is too big to fit in a byte.
+	"""
+	if isinstance(intervals, bytes):
+		return intervals
+	try:
+		return bytes(intervals)
+	except ValueError:
+		return tuple(intervals)
@@ -0,0 +1,92 @@
+# coding=utf-8
+"""
+Code relating to saving progress through a long list of scales, so it can be picked up again after a crash.
+
+A checkpoint file is a line of JSON describing the settings, followed by one line of JSON per finished shard (see
+pipeline.scale_shards), giving the shard and the scales from it which survived filtering.  Shards are always finished
+in order, so the number of lines after the first says how far through we got.
+"""
+
+import json
+import os
+import time
+
+# How often to make sure the checkpoint has actually reached the disk, in seconds.
+CHECKPOINT_SYNC_INTERVAL = 30
+
+
+def read_checkpoint(checkpoint_path, settings):
+	"""
+	Reads back the finished shards from a checkpoint file, one at a time, so they needn't all be held at once.
+	:param checkpoint_path:
+	:param settings: A dictionary describing what's being generated; must match the one the checkpoint was made with.
+	:return: (shard, filtered list of scales) for each finished shard, in order.
+	"""
+
+	if not os.path.exists(checkpoint_path):
+		return
+
+	with open(checkpoint_path, "r") as checkpoint_file:
+
+		header = _read_line(checkpoint_file)
+		if header is None:
+			return
+		if header != settings:
+			raise ValueError("The checkpoint in {0} was made with different settings ({1}), so can't be resumed.".format(
+				checkpoint_path, header))
+
+		while True:
+			shard_line = _read_line(checkpoint_file)
+			if shard_line is None:
+				break
+			yield tuple(shard_line["shard"]), shard_line["scales"]
+
+
+def write_checkpoint(checkpoint_path, settings, shards, filtered_shards, finished_shard_count=0):
+	"""
+	Passes filtered shards through, saving each to the checkpoint file as it goes by.
+	:param checkpoint_path:
+	:param settings: A dictionary describing what's being generated.
+	:param shards: The shards being filtered.
+	:param filtered_shards: The filtered list of scales from each shard, in the same order.
+	:param finished_shard_count: The number of shards already in the checkpoint file, if resuming.
+	"""
+
+	if finished_shard_count > 0:
+		checkpoint_file = open(checkpoint_path, "rb+")
+		# Skip past what we've already got, dropping anything half-written when we stopped.
+		for line_i in range(finished_shard_count + 1):
+			checkpoint_file.readline()
+		checkpoint_file.truncate(checkpoint_file.tell())
+	else:
+		checkpoint_file = open(checkpoint_path, "wb")
+		_write_line(checkpoint_file, settings)
+
+	with checkpoint_file:
+		last_sync = time.time()
+		for shard, list_of_scales in zip(shards, filtered_shards):
+			_write_line(checkpoint_file, {"shard": list(shard), "scales": list_of_scales})
+
+			if time.time() - last_sync > CHECKPOINT_SYNC_INTERVAL:
+				os.fsync(checkpoint_file.fileno())
+				last_sync = time.time()
+
+			yield list_of_scales
+
+
+def _read_line(checkpoint_file):
+	"""
+	Reads one line of JSON, or None if there isn't a complete one.
+	"""
+	line = checkpoint_file.readline()
+	if not line.endswith("\n"):
+		return None
+	try:
+		return json.loads(line)
+	except ValueError:
+		return None
+
+
+def _write_line(checkpoint_file, value):
+	checkpoint_file.write((json.dumps(value, separators=(",", ":")) + "\n").encode())
+	checkpoint_file.flush()
@@ -118,7 +118,9 @@ def most_major_mode(scale):
 	modes = cyclic_permutations(scale,include_trivial=True)
 
 	m_m_m = None
-	best_score = 0
+	# Start below any possible score, so that we always pick something, even in octaves too small to have any of the
+	# intervals we're scoring for.
+	best_score = -1
 	for mode in modes:
 		mode_score = majority_score(mode)
 		if mode_score > best_score:
@@ -126,3 +128,26 @@ def most_major_mode(scale):
 			m_m_m = mode.copy()
 
 	return m_m_m
+
+
+def interval_vector(scale):
+	"""
+	The interval vector of a scale: for each interval class, from a semitone up to half an octave, the number of pairs
+	of notes in the scale which are that far apart (either way round the octave).
+	:param scale:
+	:return:
+	"""
+	octave = sum(scale)
+
+	notes = []
+	note = 0
+	for interval in scale:
+		notes.append(note)
+		note += interval
+
+	vector = [0] * (octave // 2)
+	for note_i, note in enumerate(notes):
+		for other_note in notes[note_i + 1:]:
+			distance = other_note - note
+			vector[min(distance, octave - distance) - 1] += 1
+	return vector
@@ -0,0 +1,276 @@
+# coding=utf-8
+"""
+Code relating to counting scales without listing them.
+
+Every filter we count with is a rule about which intervals may follow which, going round the scale cyclically:
+
+- Chromatic triplets: a semitone may not follow a semitone.
+- Subscales: after filtering chromatic triplets, a scale survives only if none of its intervals can be split without
+  making a chromatic triplet.  A tone can never be split, a minor third only when it's between two semitones, and
+  anything larger always can be.  So survivors are built from semitones, tones and minor thirds, where a minor third
+  is always between semitones.  (Without the chromatic triplet filter, only the chromatic scale survives.)
+- Maximum interval: just restricts which intervals we can use.
+
+So we can count scales by dynamic programming over (length, total so far, last interval), closing up the cycle at the
+end, and count modes using Burnside's lemma.
+"""
+
+from math import gcd
+
+
+def count_scales(octave, length=None, min_length=None, max_length=None, max_interval=None, chromatic_triplets=False,
+				 subscales=False, modes=False):
+	"""
+	Returns the number of scales which would be listed with the given filters applied, without listing them.
+	:param octave: The number of semitones in the octave.
+	:param length: Only count scales of exactly this length.
+	:param min_length: The shortest permitted length of scale, if any.
+	:param max_length: The longest permitted length of scale, if any.
+	:param max_interval: The largest permitted interval, if any.
+	:param chromatic_triplets: Filter out scales with chromatic triplets?
+	:param subscales: Filter out subscales of other scales?
+	:param modes: Count only one mode of each scale?
+	:return:
+	"""
+	if length is not None:
+		min_length = length
+		max_length = length
+	return sum(count_scales_by_length(octave,
+									  min_length=min_length,
+									  max_length=max_length,
+									  max_interval=max_interval,
+									  chromatic_triplets=chromatic_triplets,
+									  subscales=subscales,
+									  modes=modes).values())
+
+
+def count_scales_by_length(octave, min_length=None, max_length=None, max_interval=None, chromatic_triplets=False,
+						   subscales=False, modes=False):
+	"""
+	Returns a dictionary from each permitted length of scale to the number of scales of that length which would be
+	listed with the given filters applied.
+	:param octave: The number of semitones in the octave.
+	:param min_length: The shortest permitted length of scale, if any.
+	:param max_length: The longest permitted length of scale, if any.
+	:param max_interval: The largest permitted interval, if any.
+	:param chromatic_triplets: Filter out scales with chromatic triplets?
+	:param subscales: Filter out subscales of other scales?
+	:param modes: Count only one mode of each scale?
+	:return:
+	"""
+	rules = interval_rules(octave, max_interval, chromatic_triplets, subscales)
+	cycle_counts = count_cycles(octave, rules)
+
+	# A single interval is its own only mode, so it counts the same either way.
+	counts = {1: 1 if _single_interval_permitted(octave, rules, subscales) else 0}
+	for length in range(2, octave + 1):
+		if modes:
+			counts[length] = _count_necklaces(octave, length, rules, cycle_counts)
+		else:
+			counts[length] = cycle_counts[length][octave]
+
+	return {length: count for length, count in counts.items()
+			if _length_in_bounds(length, min_length, max_length)}
+
+
+def interval_rules(octave, max_interval=None, chromatic_triplets=False, subscales=False):
+	"""
+	Describes which intervals are permitted in a scale, and which may follow which.
+	Intervals are grouped into classes of consecutive sizes which all obey the same rules.
+	:param octave:
+	:param max_interval:
+	:param chromatic_triplets:
+	:param subscales:
+	:return: A list of (smallest, largest) interval in each class, and a set of (class, class) pairs saying which
+	class may follow which.
+	"""
+
+	if subscales and chromatic_triplets:
+		# Semitone, tone, minor third
+		classes = [(1, 1), (2, 2), (3, 3)]
+		follows = {(0, 1), (0, 2), (1, 0), (1, 1), (2, 0)}
+	elif subscales:
+		# Every scale is a subscale of the chromatic scale
+		classes = [(1, 1)]
+		follows = {(0, 0)}
+	elif chromatic_triplets:
+		# Semitones, and everything else
+		classes = [(1, 1), (2, octave)]
+		follows = {(0, 1), (1, 0), (1, 1)}
+	else:
+		classes = [(1, octave)]
+		follows = {(0, 0)}
+
+	# Trim classes down to the permitted interval sizes, keeping the class numbering the same.
+	if max_interval and max_interval > 0:
+		classes = [(smallest, min(largest, max_interval)) for smallest, largest in classes]
+
+	return classes, follows
+
+
+def count_cycles(octave, rules):
+	"""
+	Counts the sequences of two or more intervals where each interval may follow the one before, including the first
+	following the last.
+	:param octave:
+	:param rules: As returned by interval_rules
+	:return: A table, indexed by [length][total], of the number of such sequences with that many intervals adding up to
+	that total.
+	"""
+	classes, follows = rules
+
+	cycle_counts = [[0] * (octave + 1) for length in range(octave + 1)]
+
+	for first_class, (first_smallest, first_largest) in enumerate(classes):
+
+		# sequences[c][total] counts sequences (of the current length) starting with an interval in the first class and
+		# ending with an interval in class c
+		sequences = [[0] * (octave + 1) for c in classes]
+		for first_interval in range(first_smallest, min(first_largest, octave) + 1):
+			sequences[first_class][first_interval] = 1
+
+		for length in range(2, octave + 1):
+			sequences = _extend_sequences(octave, classes, follows, sequences)
+
+			# Close up the cycle
+			for last_class in range(len(classes)):
+				if (last_class, first_class) in follows:
+					for total in range(octave + 1):
+						cycle_counts[length][total] += sequences[last_class][total]
+
+	return cycle_counts
+
+
+def count_completions(octave, rules):
+	"""
+	Counts the ways of finishing off a scale, given how it started and where it's got to.
+	Used to pick scales uniformly at random, one interval at a time.
+	:param octave:
+	:param rules: As returned by interval_rules
+	:return: A table, indexed by [first_class][remaining_length][last_class][remaining_total], of the number of ways to
+	add exactly remaining_length more intervals, adding up to remaining_total, to a sequence which started with an
+	interval in first_class and so far ends with one in last_class.
+	"""
+	classes, follows = rules
+
+	completions = []
+	for first_class in range(len(classes)):
+
+		# With nothing left to add, all we need is to be able to close up the cycle
+		no_more = [[0] * (octave + 1) for c in classes]
+		for last_class in range(len(classes)):
+			if (last_class, first_class) in follows:
+				no_more[last_class][0] = 1
+
+		by_remaining_length = [no_more]
+		for remaining_length in range(1, octave + 1):
+			by_remaining_length.append(_add_next_interval(octave, classes, follows, by_remaining_length[-1]))
+
+		completions.append(by_remaining_length)
+
+	return completions
+
+
+def _extend_sequences(octave, classes, follows, sequences):
+	"""
+	Extends sequences of intervals by one more interval.
+	"""
+
+	# Running totals let us add a whole class of intervals at once
+	running_totals = []
+	for counts in sequences:
+		running_total = [0]
+		for count in counts:
+			running_total.append(running_total[-1] + count)
+		running_totals.append(running_total)
+
+	extended = [[0] * (octave + 1) for c in classes]
+	for previous_class, next_class in follows:
+		smallest, largest = classes[next_class]
+		if smallest > largest:
+			continue
+		running_total = running_totals[previous_class]
+		for total in range(smallest, octave + 1):
+			# Sum of sequences[previous_class][total - interval] for interval in smallest..largest
+			extended[next_class][total] += (running_total[total - smallest + 1]
+											- running_total[max(total - largest, 0)])
+	return extended
+
+
+def _add_next_interval(octave, classes, follows, completions):
+	"""
+	Counts the ways of finishing off a sequence with one more interval than completions counts.
+	"""
+
+	# Ways of finishing off if the next interval is in each class, by total remaining before it
+	via_class = []
+	for next_class, (smallest, largest) in enumerate(classes):
+		running_total = [0]
+		for count in completions[next_class]:
+			running_total.append(running_total[-1] + count)
+		via = [0] * (octave + 1)
+		for total in range(smallest, octave + 1):
+			via[total] = running_total[total - smallest + 1] - running_total[max(total - largest, 0)]
+		via_class.append(via)
+
+	extended = [[0] * (octave + 1) for c in classes]
+	for last_class, next_class in follows:
+		for total in range(octave + 1):
+			extended[last_class][total] += via_class[next_class][total]
+	return extended
+
+
+def _count_necklaces(octave, length, rules, cycle_counts):
+	"""
+	Counts scales of a given length up to cyclic permutation, using Burnside's lemma: the number of classes is the
+	average, over all rotations, of the number of scales that rotation leaves unchanged.
+	"""
+	classes, follows = rules
+
+	fixed_total = 0
+	for period in _divisors(length):
+		# A scale unchanged by rotating it `period` intervals is one block of `period` intervals, repeated.
+		if (octave * period) % length != 0:
+			continue
+		block_total = octave * period // length
+
+		if period == 1:
+			# A single interval repeated must be allowed to follow itself.
+			fixed = 0
+			for interval_class, (smallest, largest) in enumerate(classes):
+				if smallest <= block_total <= largest and (interval_class, interval_class) in follows:
+					fixed = 1
+		else:
+			fixed = cycle_counts[period][block_total]
+
+		fixed_total += _totient(length // period) * fixed
+
+	return fixed_total // length
+
+
+def _single_interval_permitted(octave, rules, subscales):
+	"""
+	Whether the scale consisting of a single interval is permitted.
+	"""
+	classes, follows = rules
+	# The whole octave as one interval has no neighbours, so the only thing that can stop it is its size.  Except when
+	# filtering subscales: a minor third on its own can always be split into a semitone and a tone.
+	if subscales and octave == 3:
+		return False
+	return any(smallest <= octave <= largest for smallest, largest in classes)
+
+
+def _length_in_bounds(length, min_length, max_length):
+	if min_length and min_length > 0 and length < min_length:
+		return False
+	if max_length and max_length > 0 and length > max_length:
+		return False
+	return True
+
+
+def _divisors(n):
+	return [d for d in range(1, n + 1) if n % d == 0]
+
+
+def _totient(n):
+	return len([k for k in range(1, n + 1) if gcd(k, n) == 1])
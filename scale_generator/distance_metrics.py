@@ -0,0 +1,11 @@
+# coding=utf-8
+"""
+Names of the ways of measuring how far apart two scales are (see distances.distance_block).
+
+Kept apart from distances.py so the command line can offer them without loading NumPy.
+"""
+
+HAMMING_DISTANCE = "hamming"
+INTERVAL_VECTOR_DISTANCE = "interval_vector"
+VOICE_LEADING_DISTANCE = "voice_leading"
+DISTANCE_METRICS = [HAMMING_DISTANCE, INTERVAL_VECTOR_DISTANCE, VOICE_LEADING_DISTANCE]
@@ -0,0 +1,283 @@
+# coding=utf-8
+"""
+Code relating to working out how far apart every pair of scales in a list is, for clustering them.
+
+Needs NumPy.  The distances are saved as a square matrix of 32-bit floats in a .npy file, which NumPy can open without
+reading it all in (numpy.load(path, mmap_mode="r")), with rows and columns in the order of the list.  Each scale is
+turned into a row of 0s and 1s saying which notes it plays, and the matrix is worked out a square block at a time from
+those, so only a few blocks are ever held in memory.  Blocks can be worked out in several processes at once, each
+writing straight into the file.
+
+As each block is finished it's recorded in a progress file next to the matrix (a line of JSON describing the settings,
+followed by a line of JSON per finished block), so an interrupted run can be resumed without redoing finished blocks.
+
+The distances are:
+
+- "hamming": the number of notes played by one scale but not the other.
+- "interval_vector": the Euclidean distance between the scales' interval vectors (see comparison.interval_vector).
+- "voice_leading": how far each note of each scale is from the nearest note of the other (in steps, either way round
+  the octave), added up.  This is 0 only for the same scale, and grows the further notes have to move to get from one
+  scale to the other.
+"""
+
+import hashlib
+import json
+import os
+from functools import partial
+
+import numpy
+
+from scale_generator.distance_metrics import *
+from scale_generator.printing import *
+
+# The number of rows and columns in each block of the matrix
+DISTANCE_BLOCK_SIZE = 1024
+
+# Added to the matrix's path to give its progress file's
+PROGRESS_FILE_SUFFIX = ".progress"
+
+_DISTANCE_DTYPE = numpy.float32
+
+
+def save_distance_matrix(list_of_scales, path, metric=HAMMING_DISTANCE, octave=OCTAVE, block_size=DISTANCE_BLOCK_SIZE,
+						 workers=1, resume=False, verbose=False):
+	"""
+	Works out the distance between every pair of scales, and saves them as a matrix in a .npy file.
+	:param list_of_scales: Scales, all adding up to octave.
+	:param path:
+	:param metric: One of DISTANCE_METRICS.
+	:param octave:
+	:param block_size: The number of rows and columns in each block.
+	:param workers: The number of processes to work out blocks in.
+	:param resume: Carry on from the blocks finished last time, rather than starting again?
+	:param verbose: Log each block as it's finished.
+	:return:
+	"""
+	if metric not in DISTANCE_METRICS:
+		raise ValueError("{0} isn't a distance metric: use one of {1}.".format(metric, ", ".join(DISTANCE_METRICS)))
+
+	notes = scale_note_matrix(list_of_scales, octave)
+	scale_count = len(notes)
+	settings = {
+		"metric": metric,
+		"octave": octave,
+		"scale_count": scale_count,
+		"block_size": block_size,
+		# So we don't resume a matrix of a different list
+		"scales_sha256": hashlib.sha256(notes.tobytes()).hexdigest(),
+	}
+
+	progress_path = path + PROGRESS_FILE_SUFFIX
+	finished_blocks = _read_progress(progress_path, settings) if resume and os.path.exists(path) else None
+	if finished_blocks is None:
+		# Make an empty matrix to fill in
+		numpy.lib.format.open_memmap(path, mode="w+", dtype=_DISTANCE_DTYPE, shape=(scale_count, scale_count)).flush()
+		finished_blocks = set()
+		progress_file = open(progress_path, "w")
+		_write_progress_line(progress_file, settings)
+	else:
+		progress_file = open(progress_path, "a")
+
+	# The matrix is symmetric, so we only work out the blocks on and above the diagonal, and write each one twice.
+	block_starts = range(0, scale_count, block_size)
+	blocks = [(row_start, column_start)
+			  for row_start in block_starts
+			  for column_start in block_starts
+			  if row_start <= column_start and (row_start, column_start) not in finished_blocks]
+	block_count = len(blocks) + len(finished_blocks)
+
+	# Each block only needs the notes of its own rows and columns sent to it
+	block_tasks = ((row_start, column_start,
+					notes[row_start:row_start + block_size], notes[column_start:column_start + block_size])
+				   for row_start, column_start in blocks)
+	save_this_block = partial(_save_distance_block, path=path, metric=metric, scale_count=scale_count,
+							  data_offset=_data_offset(path))
+
+	if workers > 1:
+		# Only needed with workers, and slow to import
+		from multiprocessing import Pool
+		pool = Pool(workers)
+		saved_blocks = pool.imap_unordered(save_this_block, block_tasks)
+	else:
+		pool = None
+		saved_blocks = map(save_this_block, block_tasks)
+
+	try:
+		with progress_file:
+			for block in saved_blocks:
+				# Blocks are in the file before they're recorded as finished
+				_write_progress_line(progress_file, list(block))
+				finished_blocks.add(block)
+				if verbose:
+					prints("Saved {0} of {1} blocks of distances.".format(len(finished_blocks), block_count))
+			with open(path, "rb+") as matrix_file:
+				os.fsync(matrix_file.fileno())
+			os.fsync(progress_file.fileno())
+	finally:
+		if pool is not None:
+			pool.terminate()
+
+
+def load_distance_matrix(path):
+	"""
+	Opens a matrix saved with save_distance_matrix, without reading it all in.
+	:param path:
+	:return: A read-only NumPy array.
+	"""
+	return numpy.load(path, mmap_mode="r")
+
+
+def scale_note_matrix(list_of_scales, octave=OCTAVE):
+	"""
+	Which notes each scale plays.
+	:param list_of_scales: Scales, all adding up to octave.
+	:param octave:
+	:return: An array with a row for each scale, and a column for each note, with 1 where the scale plays the note.
+	"""
+	notes = numpy.zeros((len(list_of_scales), octave), dtype=numpy.uint8)
+	for scale_i, scale in enumerate(list_of_scales):
+		if sum(scale) != octave:
+			raise ValueError("{0} doesn't add up to an octave of {1}.".format(scale_to_interval_list_str(scale), octave))
+		notes[scale_i, numpy.cumsum(scale)[:-1]] = 1
+		notes[scale_i, 0] = 1
+	return notes
+
+
+def distance_block(row_notes, column_notes, metric=HAMMING_DISTANCE):
+	"""
+	The distances between two lists of scales.
+	:param row_notes: The notes of some scales, as given by scale_note_matrix.
+	:param column_notes: The notes of some other scales.
+	:param metric: One of DISTANCE_METRICS.
+	:return: An array of the distance from each row scale to each column scale.
+	"""
+	rows = row_notes.astype(numpy.float64)
+	columns = column_notes.astype(numpy.float64)
+
+	if metric == HAMMING_DISTANCE:
+		# Notes in a row scale but not a column scale, and the other way round
+		distances = rows @ (1 - columns).T + (1 - rows) @ columns.T
+
+	elif metric == INTERVAL_VECTOR_DISTANCE:
+		row_vectors = interval_vectors(row_notes)
+		column_vectors = interval_vectors(column_notes)
+		squared_distances = ((row_vectors ** 2).sum(axis=1)[:, numpy.newaxis]
+							 + (column_vectors ** 2).sum(axis=1)[numpy.newaxis, :]
+							 - 2 * row_vectors @ column_vectors.T)
+		distances = numpy.sqrt(numpy.maximum(squared_distances, 0))
+
+	elif metric == VOICE_LEADING_DISTANCE:
+		# How far each note of each row scale is from the column scale, and the other way round
+		distances = rows @ nearest_note_distances(column_notes).T + nearest_note_distances(row_notes) @ columns.T
+
+	else:
+		raise ValueError("{0} isn't a distance metric: use one of {1}.".format(metric, ", ".join(DISTANCE_METRICS)))
+
+	return distances.astype(_DISTANCE_DTYPE)
+
+
+def interval_vectors(notes):
+	"""
+	The interval vector of each scale, as comparison.interval_vector gives it.
+	:param notes: The notes of some scales, as given by scale_note_matrix.
+	:return: An array with a row for each scale.
+	"""
+	notes = notes.astype(numpy.float64)
+	octave = notes.shape[1]
+	vectors = numpy.zeros((len(notes), octave // 2))
+	for distance in range(1, octave // 2 + 1):
+		# Pairs of notes this far apart, counting up from each note in turn
+		vectors[:, distance - 1] = (notes * numpy.roll(notes, -distance, axis=1)).sum(axis=1)
+	if octave % 2 == 0:
+		# Notes half an octave apart are that far apart counting up from either one, so were counted twice
+		vectors[:, octave // 2 - 1] /= 2
+	return vectors
+
+
+def nearest_note_distances(notes):
+	"""
+	How far each note is from the nearest note of each scale, either way round the octave.
+	:param notes: The notes of some scales, as given by scale_note_matrix.
+	:return: An array with a row for each scale, and a column for each note.
+	"""
+	octave = notes.shape[1]
+	steps = numpy.arange(octave)
+	apart = numpy.abs(steps[:, numpy.newaxis] - steps[numpy.newaxis, :])
+	apart = numpy.minimum(apart, octave - apart)
+	# Every scale plays the root, so there's always a nearest note
+	return numpy.where(notes[:, numpy.newaxis, :] == 1, apart[numpy.newaxis, :, :], octave).min(axis=2).astype(
+		numpy.float64)
+
+
+def _save_distance_block(block_task, path, metric, scale_count, data_offset):
+	"""
+	Works out a block of the matrix and its mirror image, and writes them into the file.
+	:return: Where the block starts.
+	"""
+	row_start, column_start, row_notes, column_notes = block_task
+	distances = distance_block(row_notes, column_notes, metric)
+
+	# Only the rows being written are mapped, so a matrix larger than memory isn't mapped whole for every block
+	for start, other_start, block in ((row_start, column_start, distances), (column_start, row_start, distances.T)):
+		rows = numpy.memmap(path, dtype=_DISTANCE_DTYPE, mode="r+", shape=(len(block), scale_count),
+							offset=data_offset + start * scale_count * numpy.dtype(_DISTANCE_DTYPE).itemsize)
+		rows[:, other_start:other_start + block.shape[1]] = block
+		del rows
+
+	return row_start, column_start
+
+
+def _data_offset(path):
+	"""
+	Where the matrix starts in a .npy file, after the header.
+	"""
+	with open(path, "rb") as matrix_file:
+		if numpy.lib.format.read_magic(matrix_file) == (1, 0):
+			numpy.lib.format.read_array_header_1_0(matrix_file)
+		else:
+			numpy.lib.format.read_array_header_2_0(matrix_file)
+		return matrix_file.tell()
+
+
+def _read_progress(progress_path, settings):
+	"""
+	The blocks finished last time, or None if there's no progress to carry on from.
+	"""
+	if not os.path.exists(progress_path):
+		return None
+	with open(progress_path, "r") as progress_file:
+		header = _read_progress_line(progress_file)
+		if header is None:
+			return None
+		if header != settings:
+			raise ValueError("The distances in {0} were worked out with different settings ({1}), so can't be "
+							 "resumed.".format(progress_path, header))
+		finished_blocks = set()
+		while True:
+			finished_length = progress_file.tell()
+			block = _read_progress_line(progress_file)
+			if block is None:
+				break
+			finished_blocks.add(tuple(block))
+	# Drop anything half-written when we stopped
+	with open(progress_path, "r+") as progress_file:
+		progress_file.truncate(finished_length)
+	return finished_blocks
+
+
+def _read_progress_line(progress_file):
+	"""
+	Reads one line of JSON, or None if there isn't a complete one.
+	"""
+	line = progress_file.readline()
+	if not line.endswith("\n"):
+		return None
+	try:
+		return json.loads(line)
+	except ValueError:
+		return None
+
+
+def _write_progress_line(progress_file, value):
+	progress_file.write(json.dumps(value, separators=(",", ":")) + "\n")
+	progress_file.flush()
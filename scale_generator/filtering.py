@@ -3,6 +3,7 @@
 Code for filtering lists of scales.
 """
 
+from scale_generator.catalog import *
 from scale_generator.comparison import *
 from scale_generator.lists import *
 from scale_generator.printing import *
@@ -79,10 +80,14 @@ def filter_subscales(input_scales, verbose=False):
 	# Collect scales which pass the test
 	filtered_list = []
 
+	# The scales in the list, for looking refinements (tuples) up in.  Scales hash and compare like tuples, so can go
+	# straight in.
+	present_scales = set(scale if isinstance(scale, Scale) else tuple(scale) for scale in input_scales)
+
 	for scale in input_scales:
 
-		# List of possible refinements of this scale
-		refinements = scale_refinements(scale)
+		# Possible refinements of this scale
+		refinements = iter_scale_refinements(scale)
 
 		# Record the contaminating refinement
 		contaminating_refinement = None
@@ -92,7 +97,7 @@ def filter_subscales(input_scales, verbose=False):
 		this_scale_is_clean = True
 		for refinement in refinements:
 			# ... and if one of the refinements already exists, ...
-			if refinement in input_scales:
+			if refinement in present_scales:
 				# ... we mark this scale as tainted
 				this_scale_is_clean = False
 				contaminating_refinement = refinement
@@ -105,7 +110,7 @@ def filter_subscales(input_scales, verbose=False):
 			if verbose:
 				prints("Removed {0} because it is a subscale of {1}.".format(
 					scale_to_interval_list_str(scale),
-					scale_to_interval_list_str(contaminating_refinement)))
+					scale_to_interval_list_str(list(contaminating_refinement))))
 	return filtered_list
 
 
@@ -141,25 +146,31 @@ def filter_modes(input_scales, verbose=False):
 	# The list of scales we've picked
 	accepted_scales = []
 
-	# The list of scales we've thrown away
-	rejected_scales = []
+	# The canonical modes of the scales we've picked, which stand for every mode we've picked or thrown away
+	seen_modes = set()
 
-	# For each scale, we first check if we know we need to reject it, and if not, we pick the best mode, and remember to
-	# reject all other modes in future.
+	# For each scale, we first check if we've already picked a mode of it, and if not, we pick the best mode, and
+	# remember to reject all other modes in future.
 
 	for scale in input_scales:
 
-		if scale not in rejected_scales and scale not in accepted_scales:
+		if isinstance(scale, Scale):
+			scale_canonical_mode = scale.canonical_mode
+		else:
+			scale_canonical_mode = canonical_mode(scale)
 
-			mode = most_major_mode(scale)
+		if scale_canonical_mode not in seen_modes:
+			seen_modes.add(scale_canonical_mode)
 
-			accepted_scales.append(mode)
+			if isinstance(scale, Scale):
+				mode = scale.most_major_mode
+			else:
+				mode = most_major_mode(scale)
 
-			scales_to_reject = cyclic_permutations(mode, include_trivial=False)
+			accepted_scales.append(mode)
 
-			for rejected_scale in scales_to_reject:
-				rejected_scales.append(rejected_scale)
-				if verbose:
+			if verbose:
+				for rejected_scale in cyclic_permutations(list(mode), include_trivial=False):
 					prints("Removed {0} because it is a mode of {1}.".format(
 						scale_to_interval_list_str(rejected_scale),
 						scale_to_interval_list_str(mode)))
@@ -0,0 +1,198 @@
+# coding=utf-8
+"""
+Code relating to exporting the relationships between scales as graph files, for looking at in other programs.
+
+Each scale passing the per-scale filters is a node, labelled with its intervals, its length, and its mode class: the
+node of the mode filter_modes would keep for it.  There are two kinds of edge:
+
+- "subscale" edges, from each scale to each scale with one more note which plays all of its notes (as in
+  subscale_graph.py).  The scales with none of these are the ones filter_subscales keeps.
+- "mode" edges, from each scale to the mode starting on its second note, so each mode class is a cycle.
+
+Scales are generated and written a shard at a time (see pipeline.scale_shards), going through the list once for the
+nodes and again for the edges, so only one shard is ever held in memory, however large the octave.  This works because
+whether a scale passes the per-scale filters can be told from the scale alone.
+"""
+
+from xml.sax.saxutils import escape, quoteattr
+
+from scale_generator.lookup import *
+from scale_generator.pipeline import *
+
+# The kinds of edge
+SUBSCALE_RELATION = "subscale"
+MODE_RELATION = "mode"
+
+_GRAPHML_HEAD = """<?xml version="1.0" encoding="UTF-8"?>
+<graphml xmlns="http://graphml.graphdrawing.org/xmlns">
+  <key id="intervals" for="node" attr.name="intervals" attr.type="string"/>
+  <key id="length" for="node" attr.name="length" attr.type="int"/>
+  <key id="mode_class" for="node" attr.name="mode_class" attr.type="string"/>
+  <key id="relation" for="edge" attr.name="relation" attr.type="string"/>
+  <graph id="scales" edgedefault="directed">
+"""
+_GRAPHML_TAIL = """  </graph>
+</graphml>
+"""
+
+_GEXF_HEAD = """<?xml version="1.0" encoding="UTF-8"?>
+<gexf xmlns="http://www.gexf.net/1.2draft" version="1.2">
+  <graph mode="static" defaultedgetype="directed">
+    <attributes class="node">
+      <attribute id="length" title="length" type="integer"/>
+      <attribute id="mode_class" title="mode_class" type="string"/>
+    </attributes>
+    <attributes class="edge">
+      <attribute id="relation" title="relation" type="string"/>
+    </attributes>
+"""
+_GEXF_TAIL = """  </graph>
+</gexf>
+"""
+
+
+def export_scale_graph(path, octave=OCTAVE, chromatic_triplets=False, max_interval=None, min_length=None):
+	"""
+	Writes the graph of scales to a file.  The format is chosen by the file's extension: .graphml for GraphML, .gexf for
+	GEXF, or .tsv for an edge list with a line for each edge giving its source, target and relation, separated by tabs.
+	:param path:
+	:param octave:
+	:param chromatic_triplets: Filter out scales with chromatic triplets?
+	:param max_interval: The largest permitted interval, if any.
+	:param min_length: The shortest permitted length of scale, if any.
+	:return: The number of nodes and the number of edges written.
+	"""
+	if path.endswith(".graphml"):
+		write_graph = _write_graphml
+	elif path.endswith(".gexf"):
+		write_graph = _write_gexf
+	elif path.endswith(".tsv"):
+		write_graph = _write_edge_list
+	else:
+		raise ValueError("Can't tell what kind of graph file {0} should be: use .graphml, .gexf or .tsv.".format(path))
+
+	graph_settings = dict(octave=octave, chromatic_triplets=chromatic_triplets, max_interval=max_interval,
+						  min_length=min_length)
+	with open(path, "w", encoding="utf-8") as graph_file:
+		# The edges aren't generated until all the nodes have been written
+		return write_graph(graph_file, scale_graph_nodes(**graph_settings), lambda: scale_graph_edges(**graph_settings))
+
+
+def scale_graph_nodes(octave=OCTAVE, chromatic_triplets=False, max_interval=None, min_length=None):
+	"""
+	Generates the nodes of the graph of scales.
+	:param octave:
+	:param chromatic_triplets: Filter out scales with chromatic triplets?
+	:param max_interval: The largest permitted interval, if any.
+	:param min_length: The shortest permitted length of scale, if any.
+	:return: (node, scale) for each scale, in order.
+	"""
+	for scale in _graph_scales(octave, chromatic_triplets, max_interval, min_length):
+		yield scale_node(scale), scale
+
+
+def scale_graph_edges(octave=OCTAVE, chromatic_triplets=False, max_interval=None, min_length=None):
+	"""
+	Generates the edges of the graph of scales.
+	:param octave:
+	:param chromatic_triplets: Filter out scales with chromatic triplets?
+	:param max_interval: The largest permitted interval, if any.
+	:param min_length: The shortest permitted length of scale, if any.
+	:return: (source node, target node, relation) for each edge, in order of source.
+	"""
+	for scale in _graph_scales(octave, chromatic_triplets, max_interval, min_length):
+		node = scale_node(scale)
+
+		# Splitting an interval in two gives a scale which is longer and has no larger intervals, so it's only left out
+		# of the list if it has a chromatic triplet.
+		for interval_i, interval in enumerate(scale):
+			for split in range(1, interval):
+				refinement = scale[:interval_i] + [split, interval - split] + scale[interval_i + 1:]
+				if not (chromatic_triplets and contains_chromatic_triplets(refinement)):
+					yield node, scale_node(refinement), SUBSCALE_RELATION
+
+		# Modes of a scale pass all the same per-scale filters
+		mode = cyclic_shift(scale)
+		if mode != scale:
+			yield node, scale_node(mode), MODE_RELATION
+
+
+def scale_node(scale):
+	"""
+	The name of a scale's node in the graph, e.g. "2-2-1-2-2-2-1".
+	:param scale:
+	:return:
+	"""
+	return "-".join(str(interval) for interval in scale)
+
+
+def mode_class_node(scale):
+	"""
+	The node of the mode of a scale which filter_modes keeps, which stands for all its modes.
+	:param scale:
+	:return:
+	"""
+	return scale_node(kept_mode(scale))
+
+
+def _graph_scales(octave, chromatic_triplets, max_interval, min_length):
+	"""
+	Generates the scales passing the per-scale filters, a shard at a time.
+	"""
+	for shard in scale_shards(octave):
+		for scale in filter_shard(shard, octave=octave, chromatic_triplets=chromatic_triplets,
+								  max_interval=max_interval, min_length=min_length):
+			yield scale
+
+
+def _write_graphml(graph_file, nodes, make_edges):
+	node_count = 0
+	edge_count = 0
+	graph_file.write(_GRAPHML_HEAD)
+	for node, scale in nodes:
+		graph_file.write(
+			'    <node id={0}><data key="intervals">{1}</data><data key="length">{2}</data>'
+			'<data key="mode_class">{3}</data></node>\n'.format(
+				quoteattr(node), escape(scale_to_interval_list_str(scale)), len(scale),
+				escape(mode_class_node(scale))))
+		node_count += 1
+	for source, target, relation in make_edges():
+		graph_file.write('    <edge source={0} target={1}><data key="relation">{2}</data></edge>\n'.format(
+			quoteattr(source), quoteattr(target), escape(relation)))
+		edge_count += 1
+	graph_file.write(_GRAPHML_TAIL)
+	return node_count, edge_count
+
+
+def _write_gexf(graph_file, nodes, make_edges):
+	node_count = 0
+	edge_count = 0
+	graph_file.write(_GEXF_HEAD)
+	graph_file.write("    <nodes>\n")
+	for node, scale in nodes:
+		graph_file.write(
+			'      <node id={0} label={1}><attvalues><attvalue for="length" value="{2}"/>'
+			'<attvalue for="mode_class" value={3}/></attvalues></node>\n'.format(
+				quoteattr(node), quoteattr(scale_to_interval_list_str(scale)), len(scale),
+				quoteattr(mode_class_node(scale))))
+		node_count += 1
+	graph_file.write("    </nodes>\n")
+	graph_file.write("    <edges>\n")
+	for source, target, relation in make_edges():
+		graph_file.write(
+			'      <edge id="{0}" source={1} target={2}><attvalues><attvalue for="relation" value={3}/></attvalues>'
+			'</edge>\n'.format(edge_count, quoteattr(source), quoteattr(target), quoteattr(relation)))
+		edge_count += 1
+	graph_file.write("    </edges>\n")
+	graph_file.write(_GEXF_TAIL)
+	return node_count, edge_count
+
+
+def _write_edge_list(graph_file, nodes, make_edges):
+	# Nodes only appear in an edge list through their edges, but are still counted
+	node_count = sum(1 for node in nodes)
+	edge_count = 0
+	for source, target, relation in make_edges():
+		graph_file.write("{0}\t{1}\t{2}\n".format(source, target, relation))
+		edge_count += 1
+	return node_count, edge_count
@@ -0,0 +1,10 @@
+# coding=utf-8
+"""
+Names of the ways of arranging MIDI files in a directory (see midi.midi_file_path).
+
+Kept apart from midi.py so the command line can offer them without loading everything needed to write MIDI files.
+"""
+
+FLAT_LAYOUT = "flat"
+SHARDED_LAYOUT = "sharded"
+MIDI_LAYOUTS = [FLAT_LAYOUT, SHARDED_LAYOUT]
@@ -0,0 +1,146 @@
+# coding=utf-8
+"""
+Code relating to looking up a single scale: where it is in the listing, its modes, and which filters would remove it.
+
+Everything is worked out from the scale itself, so nothing needs to be generated: its number in the listing comes from
+its rank among scales of the same length (see scales.scale_rank), and the filters it would fall foul of can be decided
+by looking at its modes and refinements, because of the way the filters work:
+
+- Modes: the filter keeps, for each set of modes, the most major mode of the first one it meets.  Modes all have the
+  same length, so that's the first of them in lexicographic order.
+- Subscales: a scale is removed if one of its refinements is still in the list by then, which means any refinement at
+  all, or (when filtering chromatic triplets too) any refinement without chromatic triplets.
+"""
+
+from scale_generator.filtering import *
+
+
+def parse_scale(text, octave=OCTAVE):
+	"""
+	Reads a scale written as its intervals, e.g. "2 2 1 2 2 2 1" or "2,2,1,2,2,2,1".
+	:param text:
+	:param octave: What the intervals must add up to.
+	:return:
+	"""
+	try:
+		scale = [int(interval) for interval in text.replace(",", " ").split()]
+	except ValueError:
+		raise ValueError("The intervals of a scale must be whole numbers, not {0!r}.".format(text))
+	if not scale or min(scale) < 1 or sum(scale) != octave:
+		raise ValueError("The intervals of a scale must be positive and add up to {0}.".format(octave))
+	return scale
+
+
+def listing_number(scale):
+	"""
+	The number of a scale in the unfiltered listing, counting from 1.
+	:param scale:
+	:return:
+	"""
+	octave = sum(scale)
+	shorter_scale_count = sum(count_scales_of_length(length, octave) for length in range(1, len(scale)))
+	return shorter_scale_count + scale_rank(scale) + 1
+
+
+def scale_modes(scale):
+	"""
+	The different modes of a scale, starting with the scale itself, in the order you reach them by starting on each
+	note in turn.
+	:param scale:
+	:return:
+	"""
+	modes = []
+	for shift in range(len(scale)):
+		mode = cyclic_shift(scale, shift)
+		if mode not in modes:
+			modes.append(mode)
+	return modes
+
+
+def kept_mode(scale):
+	"""
+	The mode of a scale which filter_modes keeps.
+	:param scale:
+	:return:
+	"""
+	return most_major_mode(min(scale_modes(scale)))
+
+
+def subscale_of(scale, chromatic_triplets=False):
+	"""
+	A refinement of a scale which would cause filter_subscales to remove it, or None if it would be kept.
+	:param scale:
+	:param chromatic_triplets: Whether chromatic triplets have been filtered out first.
+	:return:
+	"""
+	for refinement in iter_scale_refinements(scale):
+		if not (chromatic_triplets and contains_chromatic_triplets(list(refinement))):
+			return list(refinement)
+	return None
+
+
+def rejecting_filters(scale):
+	"""
+	Describes each filtering option which would remove a scale, and why.
+	:param scale:
+	:return: A list of (option, reason).
+	"""
+	rejections = []
+	octave = sum(scale)
+
+	has_chromatic_triplets = contains_chromatic_triplets(scale)
+	if has_chromatic_triplets:
+		rejections.append(("--filter_chromatic_triplets", "it contains a chromatic triplet"))
+
+	refinement = subscale_of(scale)
+	if refinement is not None:
+		rejections.append(("--filter_subscales", "it is a subscale of {0}".format(
+			scale_to_interval_list_str(refinement))))
+	if not has_chromatic_triplets:
+		refinement = subscale_of(scale, chromatic_triplets=True)
+		if refinement is not None:
+			rejections.append(("--filter_subscales --filter_chromatic_triplets", "it is a subscale of {0}".format(
+				scale_to_interval_list_str(refinement))))
+
+	mode = kept_mode(scale)
+	if mode != scale:
+		rejections.append(("--filter_modes", "it is a mode of {0}".format(scale_to_interval_list_str(mode))))
+
+	if max(scale) > 1:
+		rejections.append(("--max_interval N, for N below {0}".format(max(scale)),
+						   "it contains an interval of {0}".format(max(scale))))
+
+	if len(scale) < octave:
+		rejections.append(("--min_length N, for N above {0}".format(len(scale)),
+						   "it has length {0}".format(len(scale))))
+
+	return rejections
+
+
+def display_scale_lookup(scale):
+	"""
+	Display everything about a scale.
+	:param scale:
+	:return:
+	"""
+	octave = sum(scale)
+	total_count = sum(count_scales_of_length(length, octave) for length in range(1, octave + 1))
+
+	prints()
+	prints("Looking up scale...")
+	prints("Scale", '\t', scale_to_interval_list_str(scale), "\t\t", scale_to_note_list_str(scale))
+	prints("Number", '\t', "{0} of {1} (without filtering)".format(listing_number(scale), total_count))
+	prints("Length", '\t', len(scale))
+	prints("Mask", '\t', scale_to_mask(scale))
+	prints("Interval vector", '\t', interval_vector(scale))
+	prints("Most major mode", '\t', scale_to_interval_list_str(most_major_mode(scale)))
+
+	prints()
+	prints("Modes...")
+	for mode in scale_modes(scale):
+		prints(listing_number(mode), '\t', scale_to_interval_list_str(mode), "\t\t", scale_to_note_list_str(mode))
+
+	prints()
+	prints("Removed by...")
+	for option, reason in rejecting_filters(scale):
+		prints(option, '\t', "because {0}.".format(reason))
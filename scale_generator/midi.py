@@ -3,37 +3,271 @@
 Code relating to creation of MIDI files.
 """
 
+import hashlib
+import io
+import json
 import os
+import shutil
+import struct
+import tarfile
+import tempfile
+import time
+import zipfile
+from functools import lru_cache, partial
+from multiprocessing import Pool
 
-from midiutil.MidiFile3 import MIDIFile
+from midiutil.MidiFile3 import MIDIFile, TICKSPERBEAT, frequencyTransform, iterNoteEvents, packVarLength, readNoteEvents
 
+from scale_generator.layouts import *
+from scale_generator.printing import *
 
-def save_scales_as_midi(list_of_scales, save_path):
+# The most MIDI files handed to a worker in one go
+MIDI_CHUNK_SIZE = 500
+
+# The name of the manifest listing the MIDI files saved
+MANIFEST_NAME = "manifest.jsonl"
+
+# How many levels of subdirectories to spread MIDI files over in the sharded layout, each with up to 256 subdirectories
+SHARD_DIRECTORY_LEVELS = 2
+
+# The most tracks a MIDI file can have
+MAX_MIDI_TRACKS = 0xFFFF
+
+# How many rendered MIDI files to keep in memory (see render_scale_midi)
+RENDER_CACHE_SIZE = 4096
+
+# Change this whenever the bytes saved for a scale change, so incremental saving knows to save them again
+MIDI_FORMAT_VERSION = 1
+
+# The highest MIDI key
+MAX_MIDI_KEY = 127
+
+# MIDI Tuning Standard messages: the sub-ID of the message, the single note tuning change, and the tuning program changed
+_MTS_CODE = 0x08
+_MTS_SINGLE_NOTE_TUNING = 0x02
+_TUNING_PROGRAM = 0
+
+# The volume (velocity) of every note
+VOLUME = 100
+
+# Pieces of the MIDI file intervals_to_midi_bytes writes.  These are exactly the bytes MIDIFile writes for one track
+# with a name, a tempo and a run of one-beat notes, one after another.
+_TRACK_CHUNK_ID = b'MTrk'
+_TRACK_NAME_START = b'\x00\xff\x03'
+_TEMPO_START = b'\x00\xff\x51\x03'
+_MARKER_START = b'\x00\xff\x06'
+_BEAT_REST_MARKER_START = packVarLength(TICKSPERBEAT) + b'\xff\x06'
+_END_OF_TRACK = b'\x00\xff\x2f\x00'
+# Note events for each MIDI note number: note-ons straight away, note-offs a beat later.
+_NOTE_ONS = [struct.pack('>BBBB', 0x00, 0x90, note, VOLUME) for note in range(256)]
+_NOTE_OFFS = [packVarLength(TICKSPERBEAT) + struct.pack('>BBB', 0x80, note, VOLUME) for note in range(256)]
+
+
+def save_scales_as_midi(list_of_scales, save_path, workers=1, verbose=False, layout=FLAT_LAYOUT, starting_note=69,
+						tempo_bpm=120, tuning_octave=None, previous_manifest=None, pool=None):
 	"""
 	Display and save to MIDI files.
 	:param save_path:
 	:param list_of_scales:
+	:param workers: The number of processes to encode and save files in.
+	:param verbose: Log each chunk of files as it's saved.
+	:param layout: How to name and arrange the files (see midi_file_path).
+	:param starting_note:
+	:param tempo_bpm:
+	:param tuning_octave: If given, tune the scales to this many equal steps per octave (see
+	intervals_to_microtonal_midifile), rather than playing each step as a semitone.
+	:param previous_manifest: A dictionary from path to manifest entry for files saved before.  Files whose content key
+	(see midi_content_key) is unchanged since then aren't saved again.
+	:param pool: A multiprocessing Pool to save files in, if any, so one pool can be used for many calls.  Otherwise one
+	is started for this call if workers > 1.
+	:return: A manifest entry (see _manifest_entry) for each scale, in the same order as the scales.
+	"""
+
+	# Leave out files which haven't changed since last time
+	if previous_manifest:
+		unchanged_entries = [_unchanged_manifest_entry(scale, save_path, layout, starting_note, tempo_bpm, tuning_octave,
+													   previous_manifest)
+							 for scale in list_of_scales]
+	else:
+		unchanged_entries = [None] * len(list_of_scales)
+	scales_to_save = [scale for scale, unchanged_entry in zip(list_of_scales, unchanged_entries)
+					  if unchanged_entry is None]
+
+	# Split the work up into chunks, so workers aren't handed one tiny file at a time.
+	chunks = [scales_to_save[chunk_start:chunk_start + MIDI_CHUNK_SIZE]
+			  for chunk_start in range(0, len(scales_to_save), MIDI_CHUNK_SIZE)]
+	save_this_chunk = partial(_save_midi_chunk, save_path=save_path, layout=layout, starting_note=starting_note,
+							  tempo_bpm=tempo_bpm, tuning_octave=tuning_octave)
+
+	# It's not worth handing a single chunk to a worker, or starting up workers for it
+	if len(chunks) > 1 and pool is not None:
+		own_pool = None
+		saved_chunks = pool.imap(save_this_chunk, chunks)
+	elif len(chunks) > 1 and workers > 1:
+		own_pool = Pool(workers)
+		saved_chunks = own_pool.imap(save_this_chunk, chunks)
+	else:
+		own_pool = None
+		saved_chunks = map(save_this_chunk, chunks)
+
+	# Chunks come back in order, whichever finishes first.
+	saved_entries = []
+	try:
+		for saved_chunk in saved_chunks:
+			saved_entries.extend(saved_chunk)
+			if verbose:
+				prints("Saved {0} of {1} new or changed MIDI files, up to {2}.".format(
+					len(saved_entries), len(scales_to_save), saved_chunk[-1]["path"]))
+	finally:
+		if own_pool is not None:
+			own_pool.terminate()
+
+	if verbose and len(scales_to_save) < len(list_of_scales):
+		prints("Skipped {0} unchanged MIDI files.".format(len(list_of_scales) - len(scales_to_save)))
+
+	# Put the new entries back in among the unchanged ones
+	saved_entries = iter(saved_entries)
+	return [unchanged_entry if unchanged_entry is not None else next(saved_entries)
+			for unchanged_entry in unchanged_entries]
+
+
+def midi_content_key(scale, starting_note, tempo_bpm, track_name, tuning_octave=None):
+	"""
+	A key which changes whenever the bytes of a scale's MIDI file would, without having to produce them.
+	:param scale:
+	:param starting_note:
+	:param tempo_bpm:
+	:param track_name:
+	:param tuning_octave:
 	:return:
 	"""
-	scale_number = 1
+	content = [MIDI_FORMAT_VERSION, list(scale), starting_note, tempo_bpm, track_name]
+	# Left out when not tuning, so keys from before tuning was possible still match
+	if tuning_octave is not None:
+		content.append(tuning_octave)
+	content = json.dumps(content)
+	return hashlib.sha256(content.encode()).hexdigest()
+
+
+def _unchanged_manifest_entry(scale, save_path, layout, starting_note, tempo_bpm, tuning_octave, previous_manifest):
+	"""
+	The previous manifest entry for a scale's MIDI file, if it's still what we'd save and the file is still there as it
+	was saved; otherwise None.
+	"""
+	midi_file_path_in_save_path = midi_file_path(scale, layout)
+	previous_entry = previous_manifest.get(midi_file_path_in_save_path)
+	if previous_entry is None:
+		return None
+	midi_file_name = os.path.join(save_path, midi_file_path_in_save_path)
+	content_key = midi_content_key(scale, starting_note, tempo_bpm, midi_file_name, tuning_octave)
+	if previous_entry.get("key") != content_key:
+		return None
+	# The file may have been deleted or changed since
+	try:
+		if os.path.getsize(midi_file_name) != previous_entry.get("bytes"):
+			return None
+	except OSError:
+		return None
+	return previous_entry
+
+
+def midi_file_path(scale, layout=FLAT_LAYOUT):
+	"""
+	Where to save the MIDI file for a scale, relative to the directory being saved to.
+
+	With the flat layout, files are named after the scale in the interval-list format, e.g.
+	`scale-[2, 2, 1, 2, 2, 2, 1].mid`, all in the one directory.
+
+	With the sharded layout, files are named after the octave and the scale's mask (see scale_to_mask) in hex, e.g.
+	`scale-12-ab5.mid`, and spread over subdirectories picked by a hash of the name, e.g. `d9/0b/scale-12-ab5.mid`, so
+	that no directory gets too big.
+	:param scale:
+	:param layout:
+	:return:
+	"""
+	if layout == FLAT_LAYOUT:
+		return "scale-{0}.mid".format(scale)
+	elif layout == SHARDED_LAYOUT:
+		hex_digits = (sum(scale) + 3) // 4
+		# The octave is in the name too, as scales in different octaves can have the same mask
+		midi_file_name = "scale-{0}-{1:0{2}x}.mid".format(sum(scale), scale_to_mask(scale), hex_digits)
+		name_hash = hashlib.sha1(midi_file_name.encode()).hexdigest()
+		shard_directories = [name_hash[level * 2:level * 2 + 2] for level in range(SHARD_DIRECTORY_LEVELS)]
+		# Always separated with slashes, so manifests are the same everywhere
+		return "/".join(shard_directories + [midi_file_name])
+	else:
+		raise ValueError("Unknown MIDI file layout {0}.".format(layout))
+
+
+def _save_midi_chunk(list_of_scales, save_path, layout, starting_note, tempo_bpm, tuning_octave):
+	"""
+	Saves a chunk of scales to MIDI files.
+	:return: Manifest entries for the files saved.
+	"""
+	manifest = []
+	made_directories = set()
 	for scale in list_of_scales:
 
-		midi_file_name = os.path.join(save_path, "scale-{0}.mid".format(scale))
-		midi_file = intervals_to_midifile(scale, track_name=midi_file_name)
+		midi_file_path_in_save_path = midi_file_path(scale, layout)
+		midi_file_name = os.path.join(save_path, midi_file_path_in_save_path)
+		midi_bytes = render_scale_midi(scale, starting_note=starting_note, tempo_bpm=tempo_bpm,
+									   track_name=midi_file_name, tuning_octave=tuning_octave, cache=False)
+
+		midi_directory = os.path.dirname(midi_file_name)
+		if layout != FLAT_LAYOUT and midi_directory not in made_directories:
+			os.makedirs(midi_directory, exist_ok=True)
+			made_directories.add(midi_directory)
 
 		with open(midi_file_name, "wb") as opened_file:
-			midi_file.writeFile(opened_file)
+			opened_file.write(midi_bytes)
+
+		manifest.append(_manifest_entry(scale, midi_file_path_in_save_path, midi_bytes,
+										midi_content_key(scale, starting_note, tempo_bpm, midi_file_name, tuning_octave)))
+	return manifest
+
+
+def render_scale_midi(scale, starting_note=69, tempo_bpm=120, note_duration=1, track_name="track name",
+					  tuning_octave=None, cache=True):
+	"""
+	Produces the bytes of a MIDI file playing a scale, without touching the disk.
+	Recently rendered scales are kept in memory, so asking for the same one again doesn't encode it again.
+	:param scale:
+	:param starting_note: 69 is middle A
+	:param tempo_bpm:
+	:param note_duration: How long each note lasts, in beats.
+	:param track_name:
+	:param tuning_octave: If given, tune the scale to this many equal steps per octave (see
+	intervals_to_microtonal_midifile).
+	:param cache: Keep the result in memory?  Not worth it for files which are saved once.
+	:return:
+	"""
+	if cache:
+		return _cached_scale_midi(tuple(scale), starting_note, tempo_bpm, note_duration, track_name, tuning_octave)
+	return _scale_midi(scale, starting_note, tempo_bpm, note_duration, track_name, tuning_octave)
+
+
+def _scale_midi(scale, starting_note, tempo_bpm, note_duration, track_name, tuning_octave):
+	if tuning_octave is not None:
+		return intervals_to_microtonal_midifile(scale, tuning_octave, starting_note=starting_note, tempo_bpm=tempo_bpm,
+												track_name=track_name, note_duration=note_duration).to_bytes()
+	# The template only knows about notes lasting a beat each
+	if note_duration == 1:
+		return intervals_to_midi_bytes(scale, starting_note=starting_note, tempo_bpm=tempo_bpm, track_name=track_name)
+	return intervals_to_midifile(scale, starting_note=starting_note, tempo_bpm=tempo_bpm, track_name=track_name,
+								 note_duration=note_duration).to_bytes()
 
-		scale_number += 1
 
+_cached_scale_midi = lru_cache(maxsize=RENDER_CACHE_SIZE)(_scale_midi)
 
-def intervals_to_midifile(intervals, starting_note=69, tempo_bpm=120, track_name="track name"):
+
+def intervals_to_midifile(intervals, starting_note=69, tempo_bpm=120, track_name="track name", note_duration=1):
 	"""
 	Takes a list of intervals and prodces a midi file returning that scale.
 	:param intervals:
 	:param starting_note: 69 is middle A
 	:param tempo_bpm:
 	:param track_name:
+	:param note_duration: How long each note lasts, in beats.  Notes still start a beat apart.
 	:return:
 	"""
 	current_note = starting_note
@@ -49,7 +283,6 @@ def intervals_to_midifile(intervals, starting_note=69, tempo_bpm=120, track_name
 	channel = 0
 	volume = 100
 	timestep = 1
-	note_duration = 1
 
 	# initialise time
 	time = 0
@@ -62,3 +295,533 @@ def intervals_to_midifile(intervals, starting_note=69, tempo_bpm=120, track_name
 		time += timestep
 
 	return midi_file
+
+
+def intervals_to_microtonal_midifile(intervals, octave, starting_note=69, tempo_bpm=120, track_name="track name",
+									 note_duration=1):
+	"""
+	Takes a list of intervals, measured in steps of an equal temperament with `octave` steps to the octave, and produces
+	a midi file playing that scale in tune.
+	Each note of the scale is played on its own key, counting up from the starting note, and a MIDI Tuning Standard
+	message at the start retunes all those keys at once to the notes of the scale.
+	:param intervals:
+	:param octave: The number of equal steps in the octave.
+	:param starting_note: The root is the pitch of this key normally.  69 is middle A
+	:param tempo_bpm:
+	:param track_name:
+	:param note_duration: How long each note lasts, in beats.
+	:return:
+	"""
+	keys = list(range(starting_note, starting_note + len(intervals) + 1))
+	if keys[-1] > MAX_MIDI_KEY:
+		raise ValueError("A scale of {0} notes starting on {1} doesn't fit on the MIDI keyboard.".format(
+			len(keys), starting_note))
+
+	midi_file = MIDIFile(1)
+
+	# constants
+	track = 0
+	channel = 0
+	volume = 100
+	timestep = 1
+
+	# initialise time
+	time = 0
+
+	midi_file.addTrackName(track, time, track_name)
+	midi_file.addTempo(track, time, tempo_bpm)
+	midi_file.addUniversalSysEx(track, time, _MTS_CODE, _MTS_SINGLE_NOTE_TUNING,
+								_tuning_payload(intervals, octave, starting_note, keys), realTime=True)
+
+	for key in keys:
+		midi_file.addNote(track, channel, key, time, note_duration, volume)
+		time += timestep
+
+	return midi_file
+
+
+def _tuning_payload(intervals, octave, starting_note, keys):
+	"""
+	The payload of a MIDI Tuning Standard single note tuning change, tuning each key to a note of the scale.
+	"""
+	tuning_table = edo_tuning_table(octave, starting_note)
+	payload = bytearray((_TUNING_PROGRAM, len(keys)))
+	step = 0
+	payload.append(keys[0])
+	payload.extend(tuning_table[step])
+	for key, interval in zip(keys[1:], intervals):
+		step += interval
+		payload.append(key)
+		payload.extend(tuning_table[step])
+	return bytes(payload)
+
+
+@lru_cache(maxsize=None)
+def edo_tuning_table(octave, starting_note=69):
+	"""
+	The MIDI Tuning Standard frequency bytes of each step of an equal temperament, from the root up to the octave.
+	Worked out once for each octave and starting note, and shared by every file.
+	:param octave: The number of equal steps in the octave.
+	:param starting_note: The root is the pitch of this key normally.  69 is middle A
+	:return: A list of three bytes for each step.
+	"""
+	root_frequency = 440 * 2 ** ((starting_note - 69) / 12)
+	return [bytes(frequencyTransform(root_frequency * 2 ** (step / octave)))
+			for step in range(octave + 1)]
+
+
+def intervals_to_midi_bytes(intervals, starting_note=69, tempo_bpm=120, track_name="track name"):
+	"""
+	Takes a list of intervals and produces the bytes of a midi file playing that scale.
+	Gives exactly the same bytes as writing out the MIDIFile from intervals_to_midifile, but fills in a template rather
+	than building and sorting all the MIDI events.
+	:param intervals:
+	:param starting_note: 69 is middle A
+	:param tempo_bpm:
+	:param track_name:
+	:return:
+	"""
+	return _midi_header_chunk(1) + _scale_track_chunk(intervals, starting_note, tempo_bpm, track_name)
+
+
+def read_scales_from_midi(midi_path):
+	"""
+	Reads back the scales from a MIDI file, such as those saved by save_scales_as_midi or MultitrackMidiFile.
+	:param midi_path:
+	:return: A list of the intervals between the notes of each track which has notes in it.
+	"""
+	return _scales_from_note_events(readNoteEvents(midi_path))
+
+
+def midi_bytes_to_scales(midi_bytes):
+	"""
+	Reads back the scales from the bytes of a MIDI file, such as those from intervals_to_midi_bytes.
+	:param midi_bytes:
+	:return: A list of the intervals between the notes of each track which has notes in it.
+	"""
+	return _scales_from_note_events(iterNoteEvents(midi_bytes))
+
+
+def _scales_from_note_events(note_events):
+	"""
+	The intervals between the notes started in each track.
+	"""
+	notes_by_track = {}
+	for track, time, note_on, channel, pitch, velocity in note_events:
+		if note_on:
+			notes_by_track.setdefault(track, []).append(pitch)
+	return [[note - previous_note for previous_note, note in zip(notes, notes[1:])]
+			for track, notes in sorted(notes_by_track.items())]
+
+
+def _scale_track_chunk(intervals, starting_note, tempo_bpm, track_name):
+	"""
+	The track chunk for a MIDI file playing a scale, as intervals_to_midifile would write it.
+	"""
+	midi_note_list = _midi_note_list(intervals, starting_note)
+
+	track_data = [
+		_text_event(_TRACK_NAME_START, track_name),
+		# The first note starts at the same time as the tempo is set, and comes first
+		_NOTE_ONS[midi_note_list[0]],
+		_tempo_event(tempo_bpm),
+	]
+	track_data.extend(_scale_note_events(midi_note_list))
+	track_data.append(_END_OF_TRACK)
+
+	return _track_chunk(b''.join(track_data))
+
+
+def _midi_note_list(intervals, starting_note):
+	"""
+	The MIDI note numbers of each note of a scale.
+	"""
+	current_note = starting_note
+	midi_note_list = [current_note]
+	for interval in intervals:
+		current_note += interval
+		midi_note_list.append(current_note)
+	if min(midi_note_list) < 0 or max(midi_note_list) > MAX_MIDI_KEY:
+		raise ValueError("A scale of {0} notes starting on {1} doesn't fit on the MIDI keyboard.".format(
+			len(midi_note_list), starting_note))
+	return midi_note_list
+
+
+def _scale_note_events(midi_note_list):
+	"""
+	The events after the first note-on of a scale: each note stops a beat after it starts, just as the next one starts.
+	"""
+	note_events = []
+	for previous_note, note in zip(midi_note_list, midi_note_list[1:]):
+		note_events.append(_NOTE_OFFS[previous_note])
+		note_events.append(_NOTE_ONS[note])
+	note_events.append(_NOTE_OFFS[midi_note_list[-1]])
+	return note_events
+
+
+def _text_event(event_start, text):
+	encoded_text = text.encode()
+	return event_start + packVarLength(len(encoded_text)) + encoded_text
+
+
+def _tempo_event(tempo_bpm):
+	if tempo_bpm <= 0:
+		raise ValueError("The tempo must be more than 0 beats per minute, not {0}.".format(tempo_bpm))
+	# Microseconds per beat, in three bytes
+	tempo = int(60000000 / tempo_bpm)
+	return _TEMPO_START + struct.pack('>BH', tempo >> 16 & 0xFF, tempo & 0xFFFF)
+
+
+def _midi_header_chunk(track_count):
+	return struct.pack('>4sLHHH', b'MThd', 6, 1, track_count, TICKSPERBEAT)
+
+
+def _track_chunk(track_data):
+	return _TRACK_CHUNK_ID + struct.pack('>L', len(track_data)) + track_data
+
+
+def _manifest_entry(scale, path, midi_bytes, content_key):
+	"""
+	A line of a manifest of saved MIDI files, as a dictionary.
+	"""
+	return {
+		"scale": list(scale),
+		"path": path,
+		"bytes": len(midi_bytes),
+		"sha256": hashlib.sha256(midi_bytes).hexdigest(),
+		"key": content_key,
+	}
+
+
+def read_manifest(manifest_path):
+	"""
+	Reads a manifest of saved MIDI files.
+	:param manifest_path:
+	:return: A dictionary from path to manifest entry, or an empty one if there's no manifest.
+	"""
+	if not os.path.exists(manifest_path):
+		return {}
+	manifest = {}
+	with open(manifest_path, "r") as manifest_file:
+		for line in manifest_file:
+			# Skip anything half-written
+			try:
+				entry = json.loads(line)
+			except ValueError:
+				continue
+			manifest[entry["path"]] = entry
+	return manifest
+
+
+class MidiDirectory:
+	"""
+	Saves MIDI files for scales into a directory, a list at a time, optionally writing a manifest listing each file (one
+	line of JSON per file, in the order saved), so nothing downstream needs to list the directory.
+
+	Saving can be incremental: only files which are new, would have changed since the manifest was last written, or are
+	missing or a different size from when they were saved, are saved again.  Files listed last time which aren't saved
+	this time can be deleted.
+
+	The manifest is written to a temporary file, which replaces the last one when the directory is closed, so last
+	time's manifest is kept until then.
+	"""
+
+	def __init__(self, save_path, layout=FLAT_LAYOUT, manifest=False, workers=1, verbose=False, starting_note=69,
+				 tempo_bpm=120, tuning_octave=None, incremental=False, delete_stale=False):
+		"""
+		:param save_path:
+		:param layout: How to name and arrange the files (see midi_file_path).
+		:param manifest: Write a manifest?  Always done when saving incrementally or deleting stale files.
+		:param workers: The number of processes to encode and save files in.
+		:param verbose: Log progress.
+		:param starting_note:
+		:param tempo_bpm:
+		:param tuning_octave: If given, tune the scales to this many equal steps per octave.
+		:param incremental: Skip files which haven't changed since the last manifest was written?
+		:param delete_stale: Delete files in the last manifest which aren't saved this time?
+		"""
+		self.save_path = save_path
+		self.layout = layout
+		self.workers = workers
+		self.verbose = verbose
+		self.starting_note = starting_note
+		self.tempo_bpm = tempo_bpm
+		self.tuning_octave = tuning_octave
+		self.delete_stale = delete_stale
+
+		# The manifest is opened before any files are saved into the directory
+		os.makedirs(save_path, exist_ok=True)
+		manifest_path = os.path.join(save_path, MANIFEST_NAME)
+		if incremental or delete_stale:
+			self._previous_manifest = read_manifest(manifest_path)
+		else:
+			self._previous_manifest = {}
+		self._incremental = incremental
+		self._saved_paths = set()
+		self._manifest_path = manifest_path
+
+		# Started once and used for every list saved, rather than once a list
+		self._pool = Pool(workers) if workers > 1 else None
+
+		if manifest or incremental or delete_stale:
+			self._manifest_file = open(manifest_path + ".tmp", "w")
+		else:
+			self._manifest_file = None
+
+	def save_scales(self, list_of_scales):
+		"""
+		Saves MIDI files for a list of scales.
+		:param list_of_scales:
+		:return:
+		"""
+		manifest = save_scales_as_midi(list_of_scales, self.save_path,
+									   workers=self.workers,
+									   verbose=self.verbose,
+									   layout=self.layout,
+									   starting_note=self.starting_note,
+									   tempo_bpm=self.tempo_bpm,
+									   tuning_octave=self.tuning_octave,
+									   previous_manifest=self._previous_manifest if self._incremental else None,
+									   pool=self._pool)
+		if self._manifest_file is not None:
+			for entry in manifest:
+				self._manifest_file.write(json.dumps(entry) + "\n")
+		if self._previous_manifest:
+			self._saved_paths.update(entry["path"] for entry in manifest)
+
+	def close(self, finished=True):
+		"""
+		Finishes the manifest, and deletes stale files if asked to.
+		:param finished: Were all the scales saved?  If not, nothing is known to be stale, so nothing is deleted.
+		:return:
+		"""
+		if self._pool is not None:
+			self._pool.terminate()
+			self._pool = None
+
+		if self._manifest_file is not None:
+			with self._manifest_file:
+				if not finished:
+					# Keep listing the files from last time which weren't got to, so they're still known about
+					for path, entry in self._previous_manifest.items():
+						if path not in self._saved_paths and os.path.exists(os.path.join(self.save_path, path)):
+							self._manifest_file.write(json.dumps(entry) + "\n")
+			os.replace(self._manifest_file.name, self._manifest_path)
+			self._manifest_file = None
+
+		if self.delete_stale and finished:
+			for stale_path in set(self._previous_manifest) - self._saved_paths:
+				stale_file_name = os.path.join(self.save_path, stale_path)
+				if os.path.exists(stale_file_name):
+					os.remove(stale_file_name)
+					if self.verbose:
+						prints("Deleted stale MIDI file {0}.".format(stale_path))
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close(finished=exc_type is None)
+
+
+class MidiArchive:
+	"""
+	Saves MIDI files for scales into a single zip or tar archive, along with a manifest, rather than one file each.
+
+	The type of archive is picked from the extension of the path: .zip, .tar, or .tar.gz/.tgz (which is always
+	compressed).  Files are streamed into
+	the archive as scales are saved, and the manifest (one line of JSON per file, in the order saved) is added when the
+	archive is closed.  Until then the manifest is kept in a temporary file rather than in memory.
+	"""
+
+	def __init__(self, archive_path, deflate=False, starting_note=69, tempo_bpm=120, tuning_octave=None):
+		"""
+		:param archive_path:
+		:param deflate: Compress the files in a zip archive, rather than just storing them?
+		:param starting_note:
+		:param tempo_bpm:
+		:param tuning_octave: If given, tune the scales to this many equal steps per octave.
+		"""
+		self.starting_note = starting_note
+		self.tempo_bpm = tempo_bpm
+		self.tuning_octave = tuning_octave
+		self._manifest_file = tempfile.TemporaryFile()
+		if archive_path.endswith(".zip"):
+			compression = zipfile.ZIP_DEFLATED if deflate else zipfile.ZIP_STORED
+			self._zip_file = zipfile.ZipFile(archive_path, "w", compression=compression, allowZip64=True)
+			self._tar_file = None
+		elif archive_path.endswith(".tar"):
+			self._zip_file = None
+			self._tar_file = tarfile.open(archive_path, "w")
+		elif archive_path.endswith(".tar.gz") or archive_path.endswith(".tgz"):
+			self._zip_file = None
+			self._tar_file = tarfile.open(archive_path, "w:gz")
+		else:
+			raise ValueError("Can't tell what kind of archive {0} should be: use .zip, .tar or .tar.gz.".format(
+				archive_path))
+
+	def save_scales(self, list_of_scales):
+		"""
+		Adds MIDI files for a list of scales to the archive.
+		:param list_of_scales:
+		:return:
+		"""
+		for scale in list_of_scales:
+			midi_file_name = "scale-{0}.mid".format(scale)
+			midi_bytes = render_scale_midi(scale, starting_note=self.starting_note, tempo_bpm=self.tempo_bpm,
+										   track_name=midi_file_name, tuning_octave=self.tuning_octave, cache=False)
+			self._add_file(midi_file_name, midi_bytes)
+			entry = _manifest_entry(scale, midi_file_name, midi_bytes,
+									midi_content_key(scale, self.starting_note, self.tempo_bpm, midi_file_name,
+													 self.tuning_octave))
+			self._manifest_file.write((json.dumps(entry) + "\n").encode())
+
+	def close(self):
+		"""
+		Adds the manifest and finishes off the archive.
+		:return:
+		"""
+		with self._manifest_file:
+			manifest_size = self._manifest_file.tell()
+			self._manifest_file.seek(0)
+			self._add_file_from(MANIFEST_NAME, self._manifest_file, manifest_size)
+		if self._zip_file is not None:
+			self._zip_file.close()
+		else:
+			self._tar_file.close()
+
+	def _add_file(self, file_name, file_bytes):
+		if self._zip_file is not None:
+			self._zip_file.writestr(file_name, file_bytes)
+		else:
+			self._add_file_from(file_name, io.BytesIO(file_bytes), len(file_bytes))
+
+	def _add_file_from(self, file_name, source_file, size):
+		"""
+		Copies an open file of size bytes into the archive, a piece at a time, from where it is now.
+		"""
+		if self._zip_file is not None:
+			with self._zip_file.open(file_name, "w", force_zip64=size >= zipfile.ZIP64_LIMIT) as archived_file:
+				shutil.copyfileobj(source_file, archived_file)
+		else:
+			tar_info = tarfile.TarInfo(file_name)
+			tar_info.size = size
+			tar_info.mtime = time.time()
+			self._tar_file.addfile(tar_info, source_file)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+
+class MultitrackMidiFile:
+	"""
+	Saves scales as the tracks of one type-1 (multi-track) MIDI file, each track just as it would be in the scale's own
+	MIDI file.
+
+	Tracks are streamed into the file as scales are saved, and the number of tracks is filled in when the file is
+	closed.  A MIDI file can't have more than 65535 tracks.
+	"""
+
+	def __init__(self, midi_path, starting_note=69, tempo_bpm=120, scale_count=None):
+		"""
+		:param midi_path:
+		:param starting_note:
+		:param tempo_bpm:
+		:param scale_count: How many scales will be saved, if known, so that too many for one file are turned down before
+		anything is saved, rather than part way through.
+		"""
+		if scale_count is not None and scale_count > MAX_MIDI_TRACKS:
+			raise ValueError("A MIDI file can't hold more than {0} tracks, and there are {1} scales.".format(
+				MAX_MIDI_TRACKS, scale_count))
+		self.starting_note = starting_note
+		self.tempo_bpm = tempo_bpm
+		self.track_count = 0
+		self._midi_file = open(midi_path, "wb")
+		self._midi_file.write(_midi_header_chunk(0))
+
+	def save_scales(self, list_of_scales):
+		"""
+		Adds a track for each of a list of scales.
+		:param list_of_scales:
+		:return:
+		"""
+		if self.track_count + len(list_of_scales) > MAX_MIDI_TRACKS:
+			raise ValueError("A MIDI file can't hold more than {0} tracks.".format(MAX_MIDI_TRACKS))
+		for scale in list_of_scales:
+			self._midi_file.write(_scale_track_chunk(scale, self.starting_note, self.tempo_bpm, "scale-{0}".format(scale)))
+			self.track_count += 1
+
+	def close(self):
+		"""
+		Fills in the number of tracks and closes the file.
+		:return:
+		"""
+		self._midi_file.seek(0)
+		self._midi_file.write(_midi_header_chunk(self.track_count))
+		self._midi_file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+
+class MidiSequenceFile:
+	"""
+	Saves scales one after another in a single track of one MIDI file, with a beat's rest between them and a marker
+	naming each scale where it starts.
+
+	Scales are streamed into the file as they're saved, and the length of the track is filled in when the file is
+	closed.
+	"""
+
+	def __init__(self, midi_path, starting_note=69, tempo_bpm=120):
+		self.starting_note = starting_note
+		self.scale_count = 0
+		self._midi_file = open(midi_path, "wb")
+		self._midi_file.write(_midi_header_chunk(1))
+		self._midi_file.write(_track_chunk(b''))
+		self._track_length = 0
+		self._write_track_data(_text_event(_TRACK_NAME_START, "scales") + _tempo_event(tempo_bpm))
+
+	def save_scales(self, list_of_scales):
+		"""
+		Adds a list of scales to the end of the track.
+		:param list_of_scales:
+		:return:
+		"""
+		for scale in list_of_scales:
+			midi_note_list = _midi_note_list(scale, self.starting_note)
+			# Leave a beat's rest after the previous scale
+			marker_start = _BEAT_REST_MARKER_START if self.scale_count > 0 else _MARKER_START
+			track_data = [
+				_text_event(marker_start, "scale-{0}".format(scale)),
+				_NOTE_ONS[midi_note_list[0]],
+			]
+			track_data.extend(_scale_note_events(midi_note_list))
+			self._write_track_data(b''.join(track_data))
+			self.scale_count += 1
+
+	def close(self):
+		"""
+		Ends the track, fills in its length, and closes the file.
+		:return:
+		"""
+		self._write_track_data(_END_OF_TRACK)
+		self._midi_file.seek(len(_midi_header_chunk(1)))
+		self._midi_file.write(_TRACK_CHUNK_ID + struct.pack('>L', self._track_length))
+		self._midi_file.close()
+
+	def _write_track_data(self, track_data):
+		self._midi_file.write(track_data)
+		self._track_length += len(track_data)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
@@ -0,0 +1,239 @@
+# coding=utf-8
+"""
+Code relating to generating and filtering scales in one pass.
+"""
+
+from collections import deque
+from contextlib import redirect_stdout
+from functools import partial
+from io import StringIO
+from itertools import groupby
+
+from scale_generator.checkpoint import *
+from scale_generator.filtering import *
+
+# The most scales generated and filtered in one go, when splitting the work up.
+SHARD_SIZE = 10000
+
+
+def filtered_scale_buckets(octave=OCTAVE, chromatic_triplets=False, subscales=False, modes=False, max_interval=None,
+						   min_length=None, verbose=False, workers=1, checkpoint_path=None, resume=False,
+						   interner=None):
+	"""
+	Generates the filtered list of scales one length at a time, shortest first, as lists of scales of equal length.
+
+	Filters which look at one scale at a time are applied to each length as it is generated, so only the subscale filter
+	ever needs to hold the whole list.  The results are the same as applying the filters to the whole list in the order
+	described in README.md: a refinement of a scale is always longer than it and has no larger intervals, and modes of
+	a scale all have the same length and intervals, so applying the maximum interval and minimum length filters early
+	doesn't change what the subscale and mode filters see.
+	:param octave:
+	:param chromatic_triplets: Filter out scales with chromatic triplets?
+	:param subscales: Filter out subscales of other scales?
+	:param modes: Filter out modes of other scales?
+	:param max_interval: The largest permitted interval, if any.
+	:param min_length: The shortest permitted length of scale, if any.
+	:param verbose:
+	:param workers: The number of processes to generate and filter scales in.
+	:param checkpoint_path: A file to save progress to as we go, if any.
+	:param resume: Pick up from the progress saved in checkpoint_path, rather than starting again?
+	:param interner: A ScaleInterner to turn scales into Scales with, if any, so the subscale and mode filters can share
+	them and what they work out about them.  Otherwise scales are lists.
+	"""
+
+	buckets = _per_scale_filtered_buckets(octave, chromatic_triplets, max_interval, min_length, verbose, workers,
+										  checkpoint_path, resume)
+
+	if interner is not None:
+		buckets = (interner.intern_all(bucket) for bucket in buckets)
+
+	if subscales:
+		# Refinements are always longer than the scale they refine, so we need every length before we can filter any.
+		all_scales = [scale for bucket in buckets for scale in bucket]
+		all_scales = filter_subscales(all_scales, verbose=verbose)
+		if interner is not None:
+			interner.retain(all_scales)
+		buckets = (list(bucket) for length, bucket in groupby(all_scales, key=len))
+
+	for bucket in buckets:
+		# Modes all have the same length, so each length can be filtered on its own.
+		if modes:
+			bucket = filter_modes(bucket, verbose=verbose)
+		yield bucket
+
+
+def scale_shards(octave=OCTAVE, shard_size=SHARD_SIZE):
+	"""
+	Splits the list of all scales into shards of at most shard_size scales, in order.
+	:param octave:
+	:param shard_size:
+	:return: (length, start_rank, stop_rank) for each shard, suitable for passing to scales_of_length.
+	"""
+	for length in range(1, octave + 1):
+		scale_count = count_scales_of_length(length, octave)
+		for start_rank in range(0, scale_count, shard_size):
+			yield length, start_rank, min(start_rank + shard_size, scale_count)
+
+
+def filter_shard(shard, octave=OCTAVE, chromatic_triplets=False, max_interval=None, min_length=None, verbose=False):
+	"""
+	Generates the scales in a shard, and applies the filters which look at one scale at a time.
+	:param shard: (length, start_rank, stop_rank), as given by scale_shards.
+	:param octave:
+	:param chromatic_triplets: Filter out scales with chromatic triplets?
+	:param max_interval: The largest permitted interval, if any.
+	:param min_length: The shortest permitted length of scale, if any.
+	:param verbose:
+	:return:
+	"""
+	length, start_rank, stop_rank = shard
+	list_of_scales = list(scales_of_length(length, octave, start_rank, stop_rank))
+
+	if chromatic_triplets:
+		list_of_scales = filter_by_chromatic_triples(list_of_scales, verbose=verbose)
+
+	if max_interval and max_interval > 0:
+		list_of_scales = filter_by_maximum_interval(list_of_scales, max_permitted_interval=max_interval, verbose=verbose)
+
+	if min_length and min_length > 0:
+		list_of_scales = filter_by_length(list_of_scales, minimum=min_length, verbose=verbose)
+
+	return list_of_scales
+
+
+def check_checkpoint(checkpoint_path, octave=OCTAVE, chromatic_triplets=False, max_interval=None, min_length=None):
+	"""
+	Checks that a checkpoint can be resumed with these options, so a mismatch can be reported before any work starts.
+	Raises a ValueError if not.
+	:param checkpoint_path:
+	:param octave:
+	:param chromatic_triplets: Filter out scales with chromatic triplets?
+	:param max_interval: The largest permitted interval, if any.
+	:param min_length: The shortest permitted length of scale, if any.
+	:return:
+	"""
+	finished_shards = read_checkpoint(checkpoint_path,
+									  _checkpoint_settings(octave, chromatic_triplets, max_interval, min_length))
+	# The settings are checked when the first shard is asked for
+	next(finished_shards, None)
+	finished_shards.close()
+
+
+def _checkpoint_settings(octave, chromatic_triplets, max_interval, min_length):
+	"""
+	What a checkpoint records about the list being generated, so it's only resumed for the same list.
+	"""
+	return {
+		"octave": octave,
+		"chromatic_triplets": chromatic_triplets,
+		"max_interval": max_interval,
+		"min_length": min_length,
+		"shard_size": SHARD_SIZE,
+	}
+
+
+def _per_scale_filtered_buckets(octave, chromatic_triplets, max_interval, min_length, verbose, workers,
+								checkpoint_path, resume):
+	"""
+	Generates lists of scales of each length, with the filters which look at one scale at a time applied.
+	"""
+	shards = list(scale_shards(octave, SHARD_SIZE))
+	filter_this_shard = partial(filter_shard,
+								octave=octave,
+								chromatic_triplets=chromatic_triplets,
+								max_interval=max_interval,
+								min_length=min_length,
+								verbose=verbose)
+
+	settings = _checkpoint_settings(octave, chromatic_triplets, max_interval, min_length)
+
+	filtered_shards = _filtered_shards(shards, filter_this_shard, workers, checkpoint_path, settings, resume)
+	# Shards come back in the order they were sent out, so joining them up gives the same list as doing them in turn.
+	try:
+		for bucket in _join_shards(shards, filtered_shards):
+			yield bucket
+	finally:
+		filtered_shards.close()
+
+
+def _filtered_shards(shards, filter_this_shard, workers, checkpoint_path, settings, resume):
+	"""
+	Generates the filtered list of scales from each shard, in order.
+
+	When resuming, the shards finished last time are read back from the checkpoint one at a time as they're needed, and
+	the rest are filtered once they've all been read.  Scales filtered out of the finished shards were logged last time,
+	so they aren't logged again.
+	"""
+	finished_shard_count = 0
+	if checkpoint_path and resume:
+		for shard, list_of_scales in read_checkpoint(checkpoint_path, settings):
+			if finished_shard_count >= len(shards) or shard != shards[finished_shard_count]:
+				raise ValueError("The checkpoint in {0} doesn't match the list being generated.".format(checkpoint_path))
+			finished_shard_count += 1
+			yield list_of_scales
+	remaining_shards = shards[finished_shard_count:]
+
+	if workers > 1:
+		# Only needed with workers, and slow to import
+		from multiprocessing import Pool
+		pool = Pool(workers)
+		# Workers keep what they log, and it's printed here as each shard is taken, so logs from different shards don't
+		# get mixed up.
+		filtered_shards = _log_filtered_shards(_bounded_imap(
+			pool, partial(_filter_shard_keeping_log, filter_this_shard), remaining_shards, window=2 * workers))
+	else:
+		pool = None
+		filtered_shards = map(filter_this_shard, remaining_shards)
+
+	if checkpoint_path:
+		filtered_shards = write_checkpoint(checkpoint_path, settings, remaining_shards, filtered_shards,
+										   finished_shard_count=finished_shard_count)
+
+	try:
+		for list_of_scales in filtered_shards:
+			yield list_of_scales
+	finally:
+		if pool is not None:
+			pool.terminate()
+
+
+def _join_shards(shards, filtered_shards):
+	"""
+	Joins filtered shards back up into one list per length.
+	"""
+	shard_results = zip(shards, filtered_shards)
+	for length, results in groupby(shard_results, key=lambda shard_result: shard_result[0][0]):
+		yield [scale for shard, list_of_scales in results for scale in list_of_scales]
+
+
+def _bounded_imap(pool, function, items, window):
+	"""
+	Like pool.imap, but with at most window items sent out to the workers and not yet taken, so results don't pile up
+	when they're taken more slowly than they're worked out.
+	"""
+	pending = deque()
+	for item in items:
+		if len(pending) >= window:
+			yield pending.popleft().get()
+		pending.append(pool.apply_async(function, (item,)))
+	while pending:
+		yield pending.popleft().get()
+
+
+def _filter_shard_keeping_log(filter_this_shard, shard):
+	"""
+	Filters a shard, returning what was logged along with the filtered list of scales.
+	"""
+	log = StringIO()
+	with redirect_stdout(log):
+		list_of_scales = filter_this_shard(shard)
+	return list_of_scales, log.getvalue()
+
+
+def _log_filtered_shards(filtered_shards_with_logs):
+	"""
+	Prints what was logged filtering each shard as it's taken, passing the filtered lists of scales through.
+	"""
+	for list_of_scales, log in filtered_shards_with_logs:
+		print(log, end="")
+		yield list_of_scales
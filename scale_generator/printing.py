@@ -38,15 +38,22 @@ def scale_to_note_list_str(intervals, start_with=0):
 	:param start_with:
 	"""
 
+	# Notes only have names in a 12-semitone octave.  Otherwise we number them by semitones above the root.
+	octave = sum(intervals)
+	if octave == OCTAVE:
+		note_names = NOTES
+	else:
+		note_names = ['R'] + [str(note) for note in range(1, octave)]
+
 	# Start with the specified first note
 	note_pointer = start_with
-	note_list = [NOTES[note_pointer]]
+	note_list = [note_names[note_pointer]]
 
 	for interval in intervals:
 		note_pointer += interval
 		# Wrap around if we reach the end
-		note_pointer %= OCTAVE
-		note_list.append(NOTES[note_pointer])
+		note_pointer %= octave
+		note_list.append(note_names[note_pointer])
 
 	return note_list
 
@@ -64,7 +71,33 @@ def display_scales(list_of_scales):
 	prints()
 	prints("Listing scales...")
 
-	scale_number = 1
+	display_scale_entries(list_of_scales)
+
+
+def display_scale_counts(counts_by_length):
+	"""
+	Display the number of scales of each length, and the total.
+	:param counts_by_length: A dictionary from length to number of scales.
+	:return:
+	"""
+	prints()
+	prints("Counting scales...")
+
+	for length, count in sorted(counts_by_length.items()):
+		prints(length, '\t', count)
+	prints("Total", '\t', sum(counts_by_length.values()))
+
+
+def display_scale_entries(list_of_scales, start_number=1):
+	"""
+	Display numbered entries for a list of scales, without a heading.
+	Numbering starts from start_number, so a long list can be displayed a piece at a time.
+	:param list_of_scales:
+	:param start_number:
+	:return: The number the next entry would have.
+	"""
+	scale_number = start_number
 	for scale in list_of_scales:
 		prints(scale_number, '\t', len(scale), '\t', scale_to_interval_list_str(scale), "\t\t", scale_to_note_list_str(scale))
 		scale_number += 1
+	return scale_number
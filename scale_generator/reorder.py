@@ -46,3 +46,14 @@ def cyclic_permutations(scale, include_trivial=True):
 	unique_permutation_list = [list(u_perm) for u_perm in set(tuple(perm) for perm in permutation_list)]
 
 	return unique_permutation_list
+
+
+def canonical_mode(scale):
+	"""
+	The cyclic permutation of a scale which comes first in the listing, as a tuple.  Two scales are cyclic permutations
+	of each other exactly when they have the same canonical mode.
+	:param scale:
+	:return:
+	"""
+	intervals = tuple(scale)
+	return min(intervals[shift:] + intervals[:shift] for shift in range(len(intervals)))
@@ -3,14 +3,81 @@
 Code relating to producing scales and partitioning intervals.
 """
 
+import random
+from functools import lru_cache
+from math import comb
+
+from scale_generator.counting import *
+
 # Must be the length of NOTES
 OCTAVE = 12
 
+# The largest interval whose partitions are kept once worked out (see proper_partitions)
+MAX_CACHED_PARTITION_INTERVAL = 10
+
 
 def list_all_scales():
 	return partition_with_intervals(OCTAVE)
 
 
+def iter_scales_by_length(octave=OCTAVE):
+	"""
+	Generates all scales, shortest first.
+	This is the same order as sorting list_all_scales() by length, but without building or sorting the whole list.
+	:param octave:
+	"""
+	for length in range(1, octave + 1):
+		for scale in scales_of_length(length, octave):
+			yield scale
+
+
+def scales_of_length(length, octave=OCTAVE, start_rank=0, stop_rank=None):
+	"""
+	Generates all scales with exactly `length` intervals, in the order partition_with_intervals would list them.
+	:param length:
+	:param octave:
+	:param start_rank: Start from the scale with this rank (see scale_rank), rather than the first.
+	:param stop_rank: Stop before the scale with this rank, rather than going on to the last.
+	"""
+
+	# A scale can't have more intervals than there are semitones in the octave.
+	if length < 1 or length > octave:
+		return
+
+	if stop_rank is None:
+		stop_rank = count_scales_of_length(length, octave)
+	if start_rank >= stop_rank:
+		return
+
+	scale = scale_of_rank(start_rank, length, octave)
+	remaining = stop_rank - start_rank
+
+	while True:
+		yield scale.copy()
+
+		remaining -= 1
+		if remaining == 0:
+			return
+
+		# To step to the next scale, we look for the rightmost interval (not counting the last one) which is followed
+		# by some slack: intervals after it which are larger than a semitone.
+		interval_i = length - 2
+		slack = scale[-1] - 1
+		while interval_i >= 0 and slack == 0:
+			slack += scale[interval_i] - 1
+			interval_i -= 1
+
+		# If there's nowhere to borrow from, we've had them all.
+		if interval_i < 0:
+			return
+
+		# Otherwise we widen that interval by a semitone, and make what follows it as small as possible, leaving the
+		# remaining slack in the last interval.
+		scale[interval_i] += 1
+		tail_length = length - interval_i - 1
+		scale[interval_i + 1:] = [1] * (tail_length - 1) + [slack]
+
+
 def scale_refinements(input_scale):
 	"""
 	For a given scale (list of intervals), this will return a list of scales
@@ -18,33 +85,156 @@ def scale_refinements(input_scale):
 	:param input_scale:
 	:return:
 	"""
+	return [list(refinement) for refinement in iter_scale_refinements(input_scale)]
 
-	# The list of refinements of the current scale
-	subscale_list = []
+
+def iter_scale_refinements(input_scale):
+	"""
+	Generates the refinements of a scale, in the same order as scale_refinements, as tuples.
+	:param input_scale:
+	:return:
+	"""
+	intervals = tuple(input_scale)
 
 	# We're using the interval index here as the loop variable, rather than the
 	# interval itself, as we'll use it for slicing later.
-	for interval_i in range(len(input_scale)):
-		this_interval = input_scale[interval_i]
+	for interval_i, this_interval in enumerate(intervals):
 
 		# We know we can't sub-partition a semitone.
 		if this_interval <= 1:
 			continue
 
-		# So we look at partitioning intervals greater than whole tones.
-		else:
-			# We want to exclude trivial sub-partitions
-			sub_partitions = partition_with_intervals(this_interval, proper_partitions_only=True)
+		# For each sub-partition, we see what that would look like grafted
+		# into the whole scale.
+		head = intervals[:interval_i]
+		tail = intervals[interval_i + 1:]
+		for sub_partition in proper_partitions(this_interval):
+			yield head + sub_partition + tail
+
+
+def proper_partitions(interval):
+	"""
+	The partitions of an interval into smaller intervals, excluding the trivial partition, in the order
+	partition_with_intervals gives them.
+	There are 2**(interval - 1) - 1 of them, so they're only kept once worked out for intervals up to
+	MAX_CACHED_PARTITION_INTERVAL, and generated as they're needed for larger ones.
+	:param interval: At least 2.
+	:return: An iterable of tuples, which mustn't be changed.
+	"""
+	if interval <= MAX_CACHED_PARTITION_INTERVAL:
+		return _cached_partitions(interval, True)
+	return _iter_partitions(interval, True)
+
+
+def _partitions(interval):
+	"""
+	All the partitions of an interval, including the trivial partition, as proper_partitions gives them.
+	"""
+	if interval <= MAX_CACHED_PARTITION_INTERVAL:
+		return _cached_partitions(interval, False)
+	return _iter_partitions(interval, False)
+
+
+def _iter_partitions(interval, proper_partitions_only):
+	"""
+	Generates the partitions of an interval as tuples, in the order partition_with_intervals gives them: by first
+	interval, then by the partitions of what's left, with the trivial partition last.
+	"""
+	for first_interval in range(1, interval):
+		for rest in _partitions(interval - first_interval):
+			yield (first_interval,) + rest
+	if not proper_partitions_only:
+		yield (interval,)
+
 
-			# For each sub-partition, we see what that would look like grafted
-			# into the whole scale.
-			for sub_partition in sub_partitions:
-				grafted_scale = input_scale[:interval_i] + sub_partition + input_scale[interval_i+1:]
+@lru_cache(maxsize=None)
+def _cached_partitions(interval, proper_partitions_only):
+	# Only ever called with intervals up to MAX_CACHED_PARTITION_INTERVAL, so this stays small
+	return tuple(_iter_partitions(interval, proper_partitions_only))
 
-				# And if this new scale passes the test, we add it to the list.
-				subscale_list.append(grafted_scale.copy())
 
-	return subscale_list
+def count_scales_of_length(length, octave=OCTAVE):
+	"""
+	The number of scales with exactly `length` intervals.
+	:param length:
+	:param octave:
+	:return:
+	"""
+	# Choosing a scale of this length is the same as choosing which of the other notes of the octave to play.
+	if length < 1 or length > octave:
+		return 0
+	return comb(octave - 1, length - 1)
+
+
+def scale_rank(scale):
+	"""
+	The position (counting from 0) of a scale among scales of the same length, in the order scales_of_length lists them.
+	:param scale:
+	:return:
+	"""
+	rank = 0
+	remaining_total = sum(scale)
+	remaining_length = len(scale)
+	for interval in scale[:-1]:
+		# Count the scales which match so far, but have a smaller interval here
+		for smaller_interval in range(1, interval):
+			rank += count_scales_of_length(remaining_length - 1, remaining_total - smaller_interval)
+		remaining_total -= interval
+		remaining_length -= 1
+	return rank
+
+
+def scale_of_rank(rank, length, octave=OCTAVE):
+	"""
+	The scale with a given rank among scales of a given length.  The reverse of scale_rank.
+	:param rank:
+	:param length:
+	:param octave:
+	:return:
+	"""
+	if not 0 <= rank < count_scales_of_length(length, octave):
+		raise ValueError("There is no scale of length {0} with rank {1}.".format(length, rank))
+
+	scale = []
+	remaining_total = octave
+	for remaining_length in range(length, 1, -1):
+		# Skip past whole blocks of scales with smaller intervals here
+		interval = 1
+		while rank >= count_scales_of_length(remaining_length - 1, remaining_total - interval):
+			rank -= count_scales_of_length(remaining_length - 1, remaining_total - interval)
+			interval += 1
+		scale.append(interval)
+		remaining_total -= interval
+	scale.append(remaining_total)
+	return scale
+
+
+def scale_to_mask(scale):
+	"""
+	Represents a scale as a bitmask of the notes it plays: bit n is set if the note n semitones above the root is in the
+	scale.  The root is always bit 0.
+	:param scale:
+	:return:
+	"""
+	mask = 0
+	note = 0
+	for interval in scale:
+		mask |= 1 << note
+		note += interval
+	return mask
+
+
+def mask_to_scale(mask, octave=OCTAVE):
+	"""
+	The scale played by a bitmask of notes.  The reverse of scale_to_mask.
+	:param mask:
+	:param octave:
+	:return:
+	"""
+	notes = [note for note in range(octave) if mask >> note & 1]
+	if not notes or notes[0] != 0:
+		raise ValueError("A scale's mask must include the root.")
+	return [next_note - note for note, next_note in zip(notes, notes[1:] + [octave])]
 
 
 def partition_with_intervals(remaining_length, proper_partitions_only=False):
@@ -136,3 +326,77 @@ def partition_with_intervals(remaining_length, proper_partitions_only=False):
 		# Now we have all possible partitions of our provided portion of the
 		# octave, so we can return it to the next level up.
 		return partition_list
+
+
+def sample(n, octave=OCTAVE, min_length=None, max_length=None, max_interval=None, chromatic_triplets=False, seed=None):
+	"""
+	Picks n scales uniformly at random from those satisfying the given constraints, without listing them all.
+	Each scale is picked independently, so the same scale may come up more than once.
+	:param n: The number of scales to pick.
+	:param octave:
+	:param min_length: The shortest permitted length of scale, if any.
+	:param max_length: The longest permitted length of scale, if any.
+	:param max_interval: The largest permitted interval, if any.
+	:param chromatic_triplets: Exclude scales with chromatic triplets?
+	:param seed: Seed for the random number generator, for repeatable samples.
+	:return:
+	"""
+
+	rng = random.Random(seed)
+
+	rules = interval_rules(octave, max_interval, chromatic_triplets)
+	classes, follows = rules
+	counts_by_length = count_scales_by_length(octave,
+											  min_length=min_length,
+											  max_length=max_length,
+											  max_interval=max_interval,
+											  chromatic_triplets=chromatic_triplets)
+	if sum(counts_by_length.values()) == 0:
+		raise ValueError("No scales satisfy the constraints, so none can be sampled.")
+	completions = count_completions(octave, rules)
+
+	sampled_scales = []
+	for sample_i in range(n):
+
+		# Pick a length in proportion to how many scales there are of that length
+		length = _weighted_choice(rng, [(count, length) for length, count in counts_by_length.items()])
+
+		if length == 1:
+			sampled_scales.append([octave])
+			continue
+
+		# Then pick each interval in turn, in proportion to how many scales could be finished off after picking it
+		first_class = None
+		last_class = None
+		remaining_total = octave
+		scale = []
+		for remaining_length in range(length - 1, -1, -1):
+			choices = []
+			for next_class, (smallest, largest) in enumerate(classes):
+				if last_class is not None and (last_class, next_class) not in follows:
+					continue
+				for interval in range(smallest, min(largest, remaining_total) + 1):
+					this_first_class = next_class if first_class is None else first_class
+					ways = completions[this_first_class][remaining_length][next_class][remaining_total - interval]
+					choices.append((ways, (interval, next_class)))
+			interval, last_class = _weighted_choice(rng, choices)
+			if first_class is None:
+				first_class = last_class
+			remaining_total -= interval
+			scale.append(interval)
+
+		sampled_scales.append(scale)
+
+	return sampled_scales
+
+
+def _weighted_choice(rng, choices):
+	"""
+	Picks a value from a list of (weight, value) pairs with probability proportional to its (integer) weight.
+	Works with exact integers, so stays uniform however large the weights get.
+	"""
+	pick = rng.randrange(sum(weight for weight, value in choices))
+	for weight, value in choices:
+		if pick < weight:
+			return value
+		pick -= weight
@@ -0,0 +1,469 @@
+# coding=utf-8
+"""
+Code relating to answering queries about scales over HTTP, from a catalog held in memory.
+
+The catalog is generated and filtered once, when the server starts, along with indexes into it, so each query is just a
+lookup.  Routes are plain functions from a catalog and a dictionary of query parameters to a response, so they don't
+depend on how the request arrived.
+
+Endpoints (all GET, answering in JSON except /midi):
+
+- /scales: the listing, optionally restricted by length, min_length, max_length and max_interval, a page at a time
+  with offset and limit.
+- /scale: a scale given by intervals (e.g. intervals=2,2,1,2,2,2,1), with its number in the listing.
+- /modes: the modes of a scale given by intervals, and their numbers in the listing.
+- /midi: a MIDI file playing a scale given by intervals, optionally with starting_note and tempo_bpm.
+- /stream: every scale for any octave and filters (octave, chromatic_triplets, subscales, modes, max_interval,
+  min_length), generated as it's sent rather than taken from the catalog, as chunked lines of JSON.
+
+Requests are answered on an asyncio event loop.  Streams generate and filter their scales a shard at a time in a pool
+of worker processes, so a large stream doesn't hold up other requests, and wait for each chunk to be sent before making
+the next, so a slow reader doesn't make them pile up in memory.
+"""
+
+import asyncio
+import json
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from http import HTTPStatus
+from urllib.parse import parse_qsl, urlsplit
+
+from scale_generator.lookup import *
+from scale_generator.midi import *
+from scale_generator.pipeline import *
+
+# Only answer requests from this machine, unless told otherwise
+LOCALHOST = "127.0.0.1"
+
+# How many scales /scales gives at once, unless asked for a different number, and the most it will give
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 10000
+
+# How many scales /stream sends in each chunk
+STREAM_CHUNK_SIZE = 1000
+
+# The largest octave /stream will generate scales for
+MAX_STREAM_OCTAVE = 24
+
+
+class ScaleCatalog:
+	"""
+	The filtered list of scales, with indexes for answering queries about it.
+	"""
+
+	def __init__(self, octave=OCTAVE, chromatic_triplets=False, subscales=False, modes=False, max_interval=None,
+				 min_length=None, workers=1):
+		"""
+		Generates and filters the list of scales, as the command line would list it.
+		:param octave:
+		:param chromatic_triplets: Filter out scales with chromatic triplets?
+		:param subscales: Filter out subscales of other scales?
+		:param modes: Filter out modes of other scales?
+		:param max_interval: The largest permitted interval, if any.
+		:param min_length: The shortest permitted length of scale, if any.
+		:param workers: The number of processes to generate and filter scales in.
+		"""
+		self.octave = octave
+		self.scales = [scale
+					   for bucket in filtered_scale_buckets(octave=octave,
+															chromatic_triplets=chromatic_triplets,
+															subscales=subscales,
+															modes=modes,
+															max_interval=max_interval,
+															min_length=min_length,
+															workers=workers,
+															interner=ScaleInterner())
+					   for scale in bucket]
+
+		# Where each scale is in the list
+		self._positions = {scale.intervals: position for position, scale in enumerate(self.scales)}
+
+		# The list is ordered by length, so each length is a contiguous run of it
+		self._length_ranges = {}
+		for position, scale in enumerate(self.scales):
+			start, stop = self._length_ranges.get(len(scale), (position, position))
+			self._length_ranges[len(scale)] = (start, position + 1)
+
+		self._largest_intervals = [max(scale) for scale in self.scales]
+
+	def __len__(self):
+		return len(self.scales)
+
+	def number(self, scale):
+		"""
+		The number of a scale in the listing, counting from 1, or None if it isn't listed.
+		:param scale:
+		:return:
+		"""
+		position = self._positions.get(tuple(scale))
+		if position is None:
+			return None
+		return position + 1
+
+	def query(self, min_length=None, max_length=None, max_interval=None, offset=0, limit=DEFAULT_PAGE_SIZE):
+		"""
+		The positions of scales in the list meeting some conditions, in order.
+		:param min_length: The shortest length of scale, if any.
+		:param max_length: The longest length of scale, if any.
+		:param max_interval: The largest interval, if any.
+		:param offset: How many matching scales to skip.
+		:param limit: The most positions to give.
+		:return:
+		"""
+		positions = []
+		for length, (start, stop) in sorted(self._length_ranges.items()):
+			if min_length is not None and length < min_length:
+				continue
+			if max_length is not None and length > max_length:
+				break
+			if max_interval is None:
+				# Every scale of this length matches, so skip straight to the ones we want
+				skipped = min(offset, stop - start)
+				offset -= skipped
+				start += skipped
+				matches = range(start, stop)
+			else:
+				matches = (position for position in range(start, stop)
+						   if self._largest_intervals[position] <= max_interval)
+			for position in matches:
+				if len(positions) >= limit:
+					return positions
+				if offset > 0:
+					offset -= 1
+					continue
+				positions.append(position)
+		return positions
+
+
+def route_request(catalog, path, query):
+	"""
+	Answers a request, whichever way it arrived.
+	:param catalog:
+	:param path: The path part of the URL, e.g. "/scale".
+	:param query: A dictionary from each query parameter to its value.
+	:return: (HTTP status, content type, body as bytes)
+	"""
+	route = ROUTES.get(path)
+	if route is None:
+		return _json_response({"error": "There's no endpoint at {0}.".format(path)}, status=404)
+	try:
+		return route(catalog, query)
+	except ValueError as error:
+		return _json_response({"error": str(error)}, status=400)
+	except Exception:
+		return _json_response({"error": "Something went wrong answering the request."}, status=500)
+
+
+def scales_route(catalog, query):
+	"""
+	A page of the listing, optionally restricted by length and largest interval.
+	"""
+	length = _int_parameter(query, "length")
+	min_length = _int_parameter(query, "min_length", length)
+	max_length = _int_parameter(query, "max_length", length)
+	limit = _int_parameter(query, "limit", DEFAULT_PAGE_SIZE)
+	if not 0 <= limit <= MAX_PAGE_SIZE:
+		raise ValueError("limit must be between 0 and {0}.".format(MAX_PAGE_SIZE))
+	offset = _int_parameter(query, "offset", 0)
+	if offset < 0:
+		raise ValueError("offset can't be negative.")
+
+	positions = catalog.query(min_length=min_length,
+							  max_length=max_length,
+							  max_interval=_int_parameter(query, "max_interval"),
+							  offset=offset,
+							  limit=limit)
+	return _json_response({
+		"offset": offset,
+		"scales": [_scale_entry(catalog, catalog.scales[position]) for position in positions],
+	})
+
+
+def scale_route(catalog, query):
+	"""
+	A scale, with its number in the listing.
+	"""
+	scale = _scale_parameter(catalog, query)
+	entry = _scale_entry(catalog, scale)
+	entry["mask"] = scale_to_mask(scale)
+	entry["most_major_mode"] = most_major_mode(scale)
+	return _json_response(entry)
+
+
+def modes_route(catalog, query):
+	"""
+	The modes of a scale, starting with the scale itself, with their numbers in the listing.
+	"""
+	scale = _scale_parameter(catalog, query)
+	return _json_response({
+		"scale": scale,
+		"modes": [_scale_entry(catalog, mode) for mode in scale_modes(scale)],
+		"most_major_mode": most_major_mode(scale),
+	})
+
+
+def midi_route(catalog, query):
+	"""
+	A MIDI file playing a scale.
+	"""
+	scale = _scale_parameter(catalog, query)
+	starting_note = _int_parameter(query, "starting_note", 69)
+	if not 0 <= starting_note <= MAX_MIDI_KEY:
+		raise ValueError("starting_note must be between 0 and {0}.".format(MAX_MIDI_KEY))
+	tempo_bpm = _int_parameter(query, "tempo_bpm", 120)
+	if tempo_bpm <= 0:
+		raise ValueError("tempo_bpm must be more than 0.")
+
+	midi_bytes = render_scale_midi(scale,
+								   starting_note=starting_note,
+								   tempo_bpm=tempo_bpm,
+								   track_name="scale-{0}.mid".format(scale))
+	return 200, "audio/midi", midi_bytes
+
+
+ROUTES = {
+	"/scales": scales_route,
+	"/scale": scale_route,
+	"/modes": modes_route,
+	"/midi": midi_route,
+}
+
+
+def stream_route(catalog, query, executor):
+	"""
+	Every scale for an octave and filters, generated as it's sent.
+	The parameters are checked straight away, so mistakes can be reported before anything is sent.
+	:param catalog:
+	:param query:
+	:param executor: A ProcessPoolExecutor to generate and filter the scales in.
+	:return: An asynchronous iterator of chunks of lines of JSON, one line per scale.
+	"""
+	octave = _int_parameter(query, "octave", catalog.octave)
+	if not 1 <= octave <= MAX_STREAM_OCTAVE:
+		raise ValueError("octave must be between 1 and {0}.".format(MAX_STREAM_OCTAVE))
+	return _stream_scale_lines(
+		executor,
+		octave=octave,
+		chromatic_triplets=_bool_parameter(query, "chromatic_triplets"),
+		subscales=_bool_parameter(query, "subscales"),
+		modes=_bool_parameter(query, "modes"),
+		max_interval=_int_parameter(query, "max_interval"),
+		min_length=_int_parameter(query, "min_length"))
+
+
+STREAMING_ROUTES = {
+	"/stream": stream_route,
+}
+
+
+async def _stream_scale_lines(executor, octave, chromatic_triplets, subscales, modes, max_interval, min_length):
+	"""
+	Lines of JSON for each scale, numbered as in the listing, STREAM_CHUNK_SIZE scales at a time.
+	"""
+	scale_number = 1
+	async for list_of_scales in _stream_scales(executor, octave, chromatic_triplets, subscales, modes, max_interval,
+											   min_length):
+		for chunk_start in range(0, len(list_of_scales), STREAM_CHUNK_SIZE):
+			lines = []
+			for scale in list_of_scales[chunk_start:chunk_start + STREAM_CHUNK_SIZE]:
+				lines.append(json.dumps({"number": scale_number, "scale": scale}))
+				scale_number += 1
+			yield ("\n".join(lines) + "\n").encode()
+
+
+async def _stream_scales(executor, octave, chromatic_triplets, subscales, modes, max_interval, min_length):
+	"""
+	Lists of scales, in order, generated and filtered in worker processes, so the work doesn't hold up the event loop.
+	"""
+	loop = asyncio.get_running_loop()
+	if subscales:
+		# The subscale filter needs every length at once, so the whole list is made in one go
+		buckets = await loop.run_in_executor(executor, partial(_filtered_scale_bucket_list,
+															   octave=octave,
+															   chromatic_triplets=chromatic_triplets,
+															   modes=modes,
+															   max_interval=max_interval,
+															   min_length=min_length))
+		for bucket in buckets:
+			yield bucket
+	elif modes:
+		# The mode filter needs whole lengths, so go a length at a time
+		for length in range(1, octave + 1):
+			yield await loop.run_in_executor(executor, partial(_mode_filtered_length, length,
+															   octave=octave,
+															   chromatic_triplets=chromatic_triplets,
+															   max_interval=max_interval,
+															   min_length=min_length))
+	else:
+		for shard in scale_shards(octave):
+			yield await loop.run_in_executor(executor, partial(filter_shard, shard,
+															   octave=octave,
+															   chromatic_triplets=chromatic_triplets,
+															   max_interval=max_interval,
+															   min_length=min_length))
+
+
+def _filtered_scale_bucket_list(octave, chromatic_triplets, modes, max_interval, min_length):
+	"""
+	The whole list of scales with subscales filtered out, as lists of scales of equal length.  Run in a worker process.
+	"""
+	return list(filtered_scale_buckets(octave=octave,
+									   chromatic_triplets=chromatic_triplets,
+									   subscales=True,
+									   modes=modes,
+									   max_interval=max_interval,
+									   min_length=min_length))
+
+
+def _mode_filtered_length(length, octave, chromatic_triplets, max_interval, min_length):
+	"""
+	The scales of one length with modes of other scales filtered out.  Run in a worker process.
+	"""
+	list_of_scales = []
+	for shard in scale_shards(octave):
+		if shard[0] == length:
+			list_of_scales.extend(filter_shard(shard,
+											   octave=octave,
+											   chromatic_triplets=chromatic_triplets,
+											   max_interval=max_interval,
+											   min_length=min_length))
+	return filter_modes(list_of_scales)
+
+
+def _scale_entry(catalog, scale):
+	return {
+		"number": catalog.number(scale),
+		"scale": list(scale),
+		# Scales from the catalog remember their notes
+		"notes": scale.note_list if isinstance(scale, Scale) else scale_to_note_list_str(scale),
+	}
+
+
+def _json_response(value, status=200):
+	return status, "application/json", json.dumps(value).encode()
+
+
+def _int_parameter(query, name, default=None):
+	"""
+	An integer query parameter, or the default if it's missing.
+	"""
+	if name not in query:
+		return default
+	try:
+		return int(query[name])
+	except ValueError:
+		raise ValueError("{0} must be a whole number, not {1!r}.".format(name, query[name]))
+
+
+def _bool_parameter(query, name):
+	"""
+	A yes/no query parameter, which is no if it's missing.
+	"""
+	value = query.get(name, "0").lower()
+	if value in ("1", "true", "yes"):
+		return True
+	if value in ("0", "false", "no", ""):
+		return False
+	raise ValueError("{0} must be 1 or 0, not {1!r}.".format(name, query[name]))
+
+
+def _scale_parameter(catalog, query):
+	"""
+	The scale given by the intervals query parameter, e.g. "2,2,1,2,2,2,1".
+	"""
+	if "intervals" not in query:
+		raise ValueError("Give a scale as intervals, e.g. intervals=2,2,1,2,2,2,1.")
+	return parse_scale(query["intervals"], catalog.octave)
+
+
+def serve(catalog, port, host=LOCALHOST, verbose=False, workers=1):
+	"""
+	Answers queries about a catalog over HTTP, until interrupted.
+	:param catalog:
+	:param port:
+	:param host: The address to listen on.  Only this machine, by default.
+	:param verbose: Log each request.
+	:param workers: The number of processes to generate and filter streamed scales in.
+	:return:
+	"""
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		try:
+			asyncio.run(_serve(catalog, port, host, verbose, executor))
+		except KeyboardInterrupt:
+			pass
+
+
+async def _serve(catalog, port, host, verbose, executor):
+	server = await asyncio.start_server(partial(_answer_connection, catalog, verbose, executor), host, port)
+	prints("Serving {0} scales at http://{1}:{2}/".format(len(catalog), host, server.sockets[0].getsockname()[1]))
+	async with server:
+		await server.serve_forever()
+
+
+async def _answer_connection(catalog, verbose, executor, reader, writer):
+	"""
+	Answers one HTTP request on a connection, then closes it.
+	"""
+	try:
+		request_line = (await reader.readline()).decode("latin-1").split()
+		# Skip the headers; we don't need any of them
+		while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+			pass
+		if len(request_line) != 3:
+			await _send_response(writer, *_json_response({"error": "Bad request."}, status=400))
+			return
+		method, target, version = request_line
+		if verbose:
+			prints(method, target)
+		if method != "GET":
+			await _send_response(writer, *_json_response({"error": "Only GET is supported."}, status=405))
+			return
+
+		url = urlsplit(target)
+		query = dict(parse_qsl(url.query))
+		if url.path in STREAMING_ROUTES:
+			try:
+				chunks = STREAMING_ROUTES[url.path](catalog, query, executor)
+			except ValueError as error:
+				await _send_response(writer, *_json_response({"error": str(error)}, status=400))
+			except Exception:
+				await _send_response(writer, *_json_response({"error": "Something went wrong answering the request."},
+															 status=500))
+			else:
+				await _send_stream(writer, "application/jsonl", chunks)
+		else:
+			await _send_response(writer, *route_request(catalog, url.path, query))
+
+	except (ConnectionError, asyncio.IncompleteReadError):
+		# They've gone away
+		pass
+	finally:
+		writer.close()
+
+
+async def _send_response(writer, status, content_type, body):
+	writer.write(_response_head(status, content_type, [("Content-Length", str(len(body)))]) + body)
+	await writer.drain()
+
+
+async def _send_stream(writer, content_type, chunks):
+	"""
+	Sends chunks as they're made, waiting for each to be sent before asking for the next.
+	"""
+	writer.write(_response_head(200, content_type, [("Transfer-Encoding", "chunked")]))
+	try:
+		async for chunk in chunks:
+			writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+			await writer.drain()
+		writer.write(b"0\r\n\r\n")
+		await writer.drain()
+	finally:
+		await chunks.aclose()
+
+
+def _response_head(status, content_type, headers):
+	lines = ["HTTP/1.1 {0} {1}".format(status, HTTPStatus(status).phrase),
+			 "Content-Type: {0}".format(content_type),
+			 "Connection: close"]
+	lines.extend("{0}: {1}".format(name, value) for name, value in headers)
+	return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
@@ -0,0 +1,291 @@
+# coding=utf-8
+"""
+Code relating to the graph of which scales are subscales of which.
+
+Scale A is a subscale of scale B when B plays every note A does, and more.  The graph has an edge from each scale to
+each scale in the list with exactly one more note, which is a refinement of it splitting one interval in two.  Every
+list the per-scale filters give (before the mode filter) includes every scale between any two of its scales, so these
+edges are enough to get from any scale to all the scales it's a subscale of, and the scales with no edges out are just
+the ones filter_subscales keeps.
+
+The edges are held in compressed sparse row form, as arrays: the edges out of node n are the targets from
+offsets[n] to offsets[n + 1].  Nodes are numbered by their position in the list.  A graph can be saved to a file and
+loaded again without reading it all in, as the arrays are used straight from the file.
+"""
+
+import mmap
+from array import array
+from struct import Struct
+
+from scale_generator.printing import *
+
+# Identifies subscale graph files, and the version of their layout
+_GRAPH_FILE_MAGIC = b"SCALEDAG"
+_GRAPH_FILE_VERSION = 1
+
+# Magic, version, octave, node count, edge count
+_graph_file_header = Struct("=8sIIQQ")
+
+# Array type codes for masks and offsets, and for node numbers
+_WIDE = "Q"
+_NODE = "I"
+
+
+def build_subscale_graph(list_of_scales, octave=OCTAVE):
+	"""
+	Works out the subscale graph of a list of scales.
+	:param list_of_scales: Scales, all different, all adding up to octave.
+	:param octave:
+	:return: A SubscaleGraph.
+	"""
+	masks = array(_WIDE)
+	for scale in list_of_scales:
+		if sum(scale) != octave:
+			raise ValueError("{0} doesn't add up to an octave of {1}.".format(scale_to_interval_list_str(scale), octave))
+		masks.append(scale_to_mask(scale))
+
+	nodes_by_mask = {mask: node for node, mask in enumerate(masks)}
+	if len(nodes_by_mask) != len(masks):
+		raise ValueError("The same scale appears more than once in the list.")
+
+	# Every note but the root, which every scale plays
+	notes = [1 << note for note in range(1, octave)]
+
+	# Adding a note gives a refinement; removing one gives a subscale
+	refinement_offsets, refinement_targets = _csr_edges(masks, nodes_by_mask, notes, adding=True)
+	subscale_offsets, subscale_targets = _csr_edges(masks, nodes_by_mask, notes, adding=False)
+
+	mask_order = array(_NODE, sorted(range(len(masks)), key=masks.__getitem__))
+
+	return SubscaleGraph(octave, masks, refinement_offsets, refinement_targets, subscale_offsets, subscale_targets,
+						 mask_order)
+
+
+def load_subscale_graph(path):
+	"""
+	Opens a subscale graph saved with SubscaleGraph.save.  It must be closed when finished with.
+	:param path:
+	:return: A SubscaleGraph.
+	"""
+	with open(path, "rb") as graph_file:
+		graph_map = mmap.mmap(graph_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+	magic, version, octave, node_count, edge_count = _graph_file_header.unpack_from(graph_map)
+	if magic != _GRAPH_FILE_MAGIC or version != _GRAPH_FILE_VERSION:
+		graph_map.close()
+		raise ValueError("{0} isn't a subscale graph file this version can read.".format(path))
+
+	arrays = []
+	position = _graph_file_header.size
+	for type_code, length in _array_layout(node_count, edge_count):
+		size = length * array(type_code).itemsize
+		arrays.append(memoryview(graph_map)[position:position + size].cast(type_code))
+		position = _padded(position + size)
+
+	return SubscaleGraph(octave, *arrays, graph_map=graph_map)
+
+
+class SubscaleGraph:
+	"""
+	The graph of which scales in a list are subscales of which, as built by build_subscale_graph.
+	"""
+
+	def __init__(self, octave, masks, refinement_offsets, refinement_targets, subscale_offsets, subscale_targets,
+				 mask_order, graph_map=None):
+		"""
+		:param octave:
+		:param masks: The mask of the scale at each node.
+		:param refinement_offsets: Where each node's edges to scales with one more note start in refinement_targets.
+		:param refinement_targets:
+		:param subscale_offsets: Where each node's edges to scales with one less note start in subscale_targets.
+		:param subscale_targets:
+		:param mask_order: The nodes, ordered by mask, for finding scales.
+		:param graph_map: The mmap the arrays are in, if they were loaded from a file.
+		"""
+		self.octave = octave
+		self._masks = masks
+		self._refinement_offsets = refinement_offsets
+		self._refinement_targets = refinement_targets
+		self._subscale_offsets = subscale_offsets
+		self._subscale_targets = subscale_targets
+		self._mask_order = mask_order
+		self._graph_map = graph_map
+
+	def __len__(self):
+		return len(self._masks)
+
+	@property
+	def edge_count(self):
+		return len(self._refinement_targets)
+
+	def scale(self, node):
+		"""
+		The scale at a node.
+		:param node:
+		:return:
+		"""
+		return mask_to_scale(self._masks[node], self.octave)
+
+	def node(self, scale):
+		"""
+		The node of a scale, or None if it isn't in the graph.
+		:param scale:
+		:return:
+		"""
+		if sum(scale) != self.octave:
+			return None
+		mask = scale_to_mask(scale)
+
+		# Binary search through the nodes in order of mask
+		low, high = 0, len(self._mask_order)
+		while low < high:
+			middle = (low + high) // 2
+			if self._masks[self._mask_order[middle]] < mask:
+				low = middle + 1
+			else:
+				high = middle
+		if low < len(self._mask_order) and self._masks[self._mask_order[low]] == mask:
+			return self._mask_order[low]
+		return None
+
+	def refinements(self, node):
+		"""
+		The nodes of the scales in the graph with one more note than this one, and all of its notes.
+		:param node:
+		:return:
+		"""
+		return self._refinement_targets[self._refinement_offsets[node]:self._refinement_offsets[node + 1]].tolist()
+
+	def subscales(self, node):
+		"""
+		The nodes of the scales in the graph with one less note than this one, and only its notes.
+		:param node:
+		:return:
+		"""
+		return self._subscale_targets[self._subscale_offsets[node]:self._subscale_offsets[node + 1]].tolist()
+
+	def all_refinements(self, node):
+		"""
+		The nodes of all the scales in the graph which this one is a subscale of, in order.
+		:param node:
+		:return:
+		"""
+		return self._reachable(node, self._refinement_offsets, self._refinement_targets)
+
+	def all_subscales(self, node):
+		"""
+		The nodes of all the scales in the graph which are subscales of this one, in order.
+		:param node:
+		:return:
+		"""
+		return self._reachable(node, self._subscale_offsets, self._subscale_targets)
+
+	def maximal_nodes(self):
+		"""
+		The nodes of the scales which aren't subscales of any others in the graph, in order.  For a list from the per-scale
+		filters, these are the scales filter_subscales keeps.
+		:return:
+		"""
+		offsets = self._refinement_offsets
+		return [node for node in range(len(self)) if offsets[node] == offsets[node + 1]]
+
+	def minimal_nodes(self):
+		"""
+		The nodes of the scales which have no subscales in the graph, in order.
+		:return:
+		"""
+		offsets = self._subscale_offsets
+		return [node for node in range(len(self)) if offsets[node] == offsets[node + 1]]
+
+	def save(self, path):
+		"""
+		Saves the graph to a file, to be opened again with load_subscale_graph.  Numbers are saved in this machine's
+		byte order, so the file should be loaded on the same kind of machine.
+		:param path:
+		:return:
+		"""
+		with open(path, "wb") as graph_file:
+			graph_file.write(_graph_file_header.pack(_GRAPH_FILE_MAGIC, _GRAPH_FILE_VERSION, self.octave, len(self),
+													 self.edge_count))
+			position = _graph_file_header.size
+			for graph_array in self._arrays():
+				graph_file.write(graph_array)
+				position += graph_array.nbytes
+				# Keep each array aligned, so it can be used straight from the file
+				padding = _padded(position) - position
+				graph_file.write(bytes(padding))
+				position += padding
+
+	def close(self):
+		"""
+		Closes the file the graph was loaded from, if any.
+		:return:
+		"""
+		if self._graph_map is not None:
+			# The mmap can't be closed while the arrays are still looking into it
+			for graph_array in self._arrays():
+				graph_array.release()
+			self._graph_map.close()
+			self._graph_map = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def _arrays(self):
+		return [memoryview(graph_array)
+				if isinstance(graph_array, array) else graph_array
+				for graph_array in (self._masks,
+									self._refinement_offsets, self._refinement_targets,
+									self._subscale_offsets, self._subscale_targets,
+									self._mask_order)]
+
+	def _reachable(self, node, offsets, targets):
+		"""
+		The nodes which can be reached from a node by following edges, in order.
+		"""
+		visited = bytearray(len(self))
+		visited[node] = 1
+		reached = []
+		to_visit = [node]
+		while to_visit:
+			this_node = to_visit.pop()
+			for target in targets[offsets[this_node]:offsets[this_node + 1]]:
+				if not visited[target]:
+					visited[target] = 1
+					reached.append(target)
+					to_visit.append(target)
+		reached.sort()
+		return reached
+
+
+def _csr_edges(masks, nodes_by_mask, notes, adding):
+	"""
+	The edges from each node to the nodes with one note added or removed, as offsets and targets.
+	"""
+	offsets = array(_WIDE, [0])
+	targets = array(_NODE)
+	for mask in masks:
+		for note in notes:
+			if bool(mask & note) != adding:
+				target = nodes_by_mask.get(mask ^ note)
+				if target is not None:
+					targets.append(target)
+		offsets.append(len(targets))
+	return offsets, targets
+
+
+def _array_layout(node_count, edge_count):
+	"""
+	The type and length of each array in a graph file, in order.
+	"""
+	return [(_WIDE, node_count),
+			(_WIDE, node_count + 1), (_NODE, edge_count),
+			(_WIDE, node_count + 1), (_NODE, edge_count),
+			(_NODE, node_count)]
+
+
+def _padded(position):
+	return (position + 7) // 8 * 8